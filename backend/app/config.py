@@ -1,9 +1,11 @@
-from functools import lru_cache
+from functools import cached_property, lru_cache
 from pydantic_settings import BaseSettings
 
 
 class Settings(BaseSettings):
     app_name: str = "Minesweeper API"
+    # "test" enables test-only shortcuts (e.g. cheap, memoized password hashing)
+    env: str = "production"
     db_url: str = "sqlite:///./minesweeper.db"
     # Allow both localhost and 127.0.0.1 by default; can be overridden via env var
     cors_origins: str = "http://localhost:5173,http://127.0.0.1:5173"
@@ -15,6 +17,10 @@ class Settings(BaseSettings):
     class Config:
         env_file = ".env"
 
+    @cached_property
+    def cors_origin_list(self) -> list[str]:
+        return [origin.strip() for origin in self.cors_origins.split(",") if origin.strip()]
+
 
 @lru_cache
 def get_settings() -> Settings:
@@ -1,69 +1,260 @@
-from typing import Generator
-from sqlmodel import Session, SQLModel, create_engine
-from sqlalchemy.pool import NullPool
-from sqlalchemy import text
+from typing import Any, AsyncGenerator
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.engine import Connection, URL, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlalchemy import bindparam, event, func, inspect, select, text, update
 
 from .config import get_settings
 
 settings = get_settings()
+db_url = make_url(settings.db_url)
+is_sqlite = db_url.get_backend_name() == "sqlite"
 
-# 判斷資料庫類型
-if settings.db_url.startswith("sqlite"):
-    # SQLite 不使用連線池，避免多線程寫入衝突
-    engine = create_engine(
-        settings.db_url,
-        connect_args={"check_same_thread": False},
-        poolclass=NullPool,
-    )
-else:
-    # 其他資料庫使用連線池
-    engine = create_engine(
-        settings.db_url,
-        pool_size=10,        # 固定連線數
-        max_overflow=20,     # 超過 pool_size 後可額外擴充
-    )
-
-
-def _column_exists(session: Session, table: str, column: str) -> bool:
-    if not settings.db_url.startswith("sqlite"):
-        return True
-    rows = session.exec(text(f"PRAGMA table_info({table});")).all()
-    return any(r[1] == column for r in rows)
-
-
-def _run_light_migrations() -> None:
-    if not settings.db_url.startswith("sqlite"):
-        return
-    with Session(engine) as session:
-        if not _column_exists(session, "match", "countdown_secs"):
-            session.exec(text("ALTER TABLE match ADD COLUMN countdown_secs INTEGER DEFAULT 300;"))
-        if not _column_exists(session, "matchplayer", "ready"):
-            session.exec(text("ALTER TABLE matchplayer ADD COLUMN ready BOOLEAN DEFAULT 0;"))
-        if not _column_exists(session, "matchplayer", "progress"):
-            session.exec(text("ALTER TABLE matchplayer ADD COLUMN progress TEXT;"))
-        if not _column_exists(session, "matchplayer", "user_id"):
-            session.exec(text("ALTER TABLE matchplayer ADD COLUMN user_id INTEGER;"))
-        if not _column_exists(session, "user", "handle"):
-            session.exec(text("ALTER TABLE user ADD COLUMN handle VARCHAR(50);"))
-        if not _column_exists(session, "leaderboardentry", "handle"):
-            session.exec(text("ALTER TABLE leaderboardentry ADD COLUMN handle VARCHAR(50);"))
-        if not _column_exists(session, "match", "last_active_at"):
-            session.exec(text("ALTER TABLE match ADD COLUMN last_active_at DATETIME DEFAULT CURRENT_TIMESTAMP;"))
-
-        # Backfill defaults
-        session.exec(text("UPDATE match SET countdown_secs = 300 WHERE countdown_secs IS NULL;"))
-        session.exec(text("UPDATE matchplayer SET ready = 0 WHERE ready IS NULL;"))
-        session.exec(text("UPDATE match SET last_active_at = created_at WHERE last_active_at IS NULL;"))
-        session.commit()
-
-
-def init_db() -> None:
-    SQLModel.metadata.create_all(engine)
-    _run_light_migrations()
-
-
-def get_session() -> Generator[Session, None, None]:
+# 同步 URL (sqlite:///、postgresql://) 對應的非同步驅動
+# 只支援 SQLite 與 PostgreSQL：upsert 用 ON CONFLICT，寫入後以 RETURNING 取回資料列
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def _async_url(url: URL) -> URL:
+    driver = _ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"unsupported database backend {url.get_backend_name()!r}: use sqlite or postgresql")
+    if url.drivername == driver:
+        return url
+    return url.set(drivername=driver)
+
+
+# 所有資料庫共用同一組連線池設定
+engine_kwargs: dict[str, Any] = {
+    "pool_size": 20,        # 固定連線數
+    "max_overflow": 10,     # 超過 pool_size 後可額外擴充
+    "pool_pre_ping": True,  # 取用前確認連線仍有效
+    "pool_recycle": 1800,   # 30 分鐘汰換，避開伺服器端閒置斷線 (PostgreSQL)
+}
+if is_sqlite:
+    # 連線會在不同執行緒間重用，因此需關閉 check_same_thread
+    engine_kwargs["connect_args"] = {"check_same_thread": False}
+    if db_url.database in (None, "", ":memory:"):
+        # 記憶體資料庫 (測試用) 每條連線都是獨立的空庫，只能共用單一連線
+        engine_kwargs = {"connect_args": {"check_same_thread": False}, "poolclass": StaticPool}
+
+# 非同步引擎：路由中的 DB 往返不再阻塞 event loop
+engine = create_async_engine(_async_url(db_url), **engine_kwargs)
+
+
+if is_sqlite:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, connection_record) -> None:
+        """每條新連線設定一次：WAL 讓讀寫不互相阻塞，NORMAL 減少每次 commit 的 fsync"""
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL;")
+        cursor.execute("PRAGMA synchronous=NORMAL;")
+        cursor.execute("PRAGMA temp_store=MEMORY;")
+        cursor.execute("PRAGMA mmap_size=268435456;")
+        cursor.execute("PRAGMA cache_size=-64000;")  # 負值單位為 KiB：每條連線約 64 MB page cache
+        cursor.close()
+
+
+def _table_columns(conn: Connection, table: str) -> set[str]:
+    return {column["name"] for column in inspect(conn).get_columns(table)}
+
+
+def _backfill_match_ranks(conn: Connection) -> None:
+    """rank 欄位是新加的：已結束的對戰依 _compute_standings 的規則一次算好名次"""
+    from .routes.match import _compute_standings  # 延遲匯入，routes 在模組層級依賴本模組
+
+    match_t = SQLModel.metadata.tables["match"]
+    player_t = SQLModel.metadata.tables["matchplayer"]
+    finished = select(match_t.c.id).where(match_t.c.status == "finished")
+    # 只取名次規則用到的欄位：之後的遷移才會補上的欄位此時還不存在
+    cols = [player_t.c[name] for name in ("id", "match_id", "result", "duration_ms", "steps_count", "created_at", "progress")]
+    players_by_match: dict[int, list[Any]] = {}
+    for row in conn.execute(select(*cols).where(player_t.c.match_id.in_(finished))):
+        players_by_match.setdefault(row.match_id, []).append(row)
+
+    ranks = [
+        {"pid": p.id, "r": r}
+        for players in players_by_match.values()
+        for r, p in _compute_standings(None, players)
+    ]
+    if ranks:
+        conn.execute(update(player_t).where(player_t.c.id == bindparam("pid")).values(rank=bindparam("r")), ranks)
+
+
+def _backfill_match_points(conn: Connection) -> None:
+    """points 欄位是新加的：依已存的名次與對戰人數換算一次"""
+    from .routes.match import _points_for  # 延遲匯入，同 _backfill_match_ranks
+
+    player_t = SQLModel.metadata.tables["matchplayer"]
+    seats = player_t.alias()
+    total = select(func.count()).where(seats.c.match_id == player_t.c.match_id).scalar_subquery()
+    rows = conn.execute(select(player_t.c.id, player_t.c.rank, total).where(player_t.c.rank.is_not(None)))
+    points = [{"pid": pid, "pts": _points_for(rank, n)} for pid, rank, n in rows]
+    if points:
+        conn.execute(update(player_t).where(player_t.c.id == bindparam("pid")).values(points=bindparam("pts")), points)
+
+
+def _run_legacy_sqlite_migrations(conn: Connection, cols: dict[str, set[str]]) -> None:
+    """早期只在 SQLite 上補過的欄位"""
+    if "countdown_secs" not in cols["match"]:
+        conn.execute(text("ALTER TABLE match ADD COLUMN countdown_secs INTEGER DEFAULT 300;"))
+    if "ready" not in cols["matchplayer"]:
+        conn.execute(text("ALTER TABLE matchplayer ADD COLUMN ready BOOLEAN DEFAULT 0;"))
+    if "progress" not in cols["matchplayer"]:
+        conn.execute(text("ALTER TABLE matchplayer ADD COLUMN progress TEXT;"))
+    if "user_id" not in cols["matchplayer"]:
+        conn.execute(text("ALTER TABLE matchplayer ADD COLUMN user_id INTEGER;"))
+    if "handle" not in cols["user"]:
+        conn.execute(text("ALTER TABLE user ADD COLUMN handle VARCHAR(50);"))
+    if "handle" not in cols["leaderboardentry"]:
+        conn.execute(text("ALTER TABLE leaderboardentry ADD COLUMN handle VARCHAR(50);"))
+    if "last_active_at" not in cols["match"]:
+        conn.execute(text("ALTER TABLE match ADD COLUMN last_active_at DATETIME DEFAULT CURRENT_TIMESTAMP;"))
+
+    # Backfill defaults
+    conn.execute(text("UPDATE match SET countdown_secs = 300 WHERE countdown_secs IS NULL;"))
+    conn.execute(text("UPDATE matchplayer SET ready = 0 WHERE ready IS NULL;"))
+    conn.execute(text("UPDATE match SET last_active_at = created_at WHERE last_active_at IS NULL;"))
+
+
+def _run_light_migrations(conn: Connection) -> None:
+    # 每張表只查一次欄位
+    cols = {t: _table_columns(conn, t) for t in ("match", "matchplayer", "user", "leaderboardentry", "blogpost")}
+    if is_sqlite:
+        _run_legacy_sqlite_migrations(conn, cols)
+
+    # 以下 SQLite 與 PostgreSQL 都要補：既有資料表不會被 create_all 加上新欄位/換掉舊索引
+    if "rank" not in cols["matchplayer"]:
+        conn.execute(text("ALTER TABLE matchplayer ADD COLUMN rank INTEGER;"))
+        _backfill_match_ranks(conn)
+    if "points" not in cols["matchplayer"]:
+        conn.execute(text("ALTER TABLE matchplayer ADD COLUMN points INTEGER NOT NULL DEFAULT 0;"))
+        _backfill_match_points(conn)
+    if "comment_count" not in cols["blogpost"]:
+        conn.execute(text("ALTER TABLE blogpost ADD COLUMN upvotes INTEGER NOT NULL DEFAULT 0;"))
+        conn.execute(text("ALTER TABLE blogpost ADD COLUMN downvotes INTEGER NOT NULL DEFAULT 0;"))
+        conn.execute(text("ALTER TABLE blogpost ADD COLUMN comment_count INTEGER NOT NULL DEFAULT 0;"))
+        # 計數欄位是新加的，從現有投票/留言回填一次
+        conn.execute(
+            text(
+                "UPDATE blogpost SET "
+                "upvotes = (SELECT COUNT(*) FROM blogvote WHERE blogvote.post_id = blogpost.id AND blogvote.value = 1), "
+                "downvotes = (SELECT COUNT(*) FROM blogvote WHERE blogvote.post_id = blogpost.id AND blogvote.value = -1), "
+                "comment_count = (SELECT COUNT(*) FROM blogcomment WHERE blogcomment.post_id = blogpost.id);"
+            )
+        )
+
+    # 已被 (difficulty, time_ms, created_at) / (player, difficulty, ...) 複合索引或 (difficulty, player) 唯一索引涵蓋
+    conn.execute(text("DROP INDEX IF EXISTS ix_leaderboardentry_difficulty;"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_leaderboardentry_player;"))
+    # 已被各自的複合索引以最左欄位涵蓋
+    conn.execute(text("DROP INDEX IF EXISTS ix_matchstep_match_id;"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_blogpost_user_id;"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_blogcomment_post_id;"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_matchplayer_match_id;"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_matchplayer_user_id;"))
+
+    token_index = next((ix for ix in inspect(conn).get_indexes("matchplayer") if ix["name"] == "ix_matchplayer_token"), None)
+    if token_index and not token_index["unique"]:
+        # token 改為唯一索引：移除舊的非唯一版本，由 _ensure_indexes 重建
+        conn.execute(text("DROP INDEX ix_matchplayer_token;"))
+
+
+# 同一場對戰中重複的座位 (同名稱或同使用者)，保留最早加入者
+_DUPLICATE_SEATS = (
+    "SELECT id FROM (SELECT id, user_id, "
+    "ROW_NUMBER() OVER (PARTITION BY match_id, name ORDER BY id) AS rn_name, "
+    "ROW_NUMBER() OVER (PARTITION BY match_id, user_id ORDER BY id) AS rn_user "
+    "FROM matchplayer) seats WHERE rn_name > 1 OR (user_id IS NOT NULL AND rn_user > 1)"
+)
+
+# 建立唯一索引前必須清掉的重複資料：(說明, SQL)。會永久刪除資料，只由 dedupe_data_base.sh 明確執行
+_DEDUPE_STATEMENTS = (
+    (
+        "leaderboard entries that are not the player's best for the difficulty",
+        "DELETE FROM leaderboardentry WHERE id NOT IN ("
+        "SELECT id FROM (SELECT id, ROW_NUMBER() OVER ("
+        "PARTITION BY difficulty, player ORDER BY time_ms, created_at, id) AS rn FROM leaderboardentry"
+        ") ranked WHERE rn = 1);",
+    ),
+    (
+        "replays of removed leaderboard entries",
+        "DELETE FROM leaderboardreplay WHERE entry_id NOT IN (SELECT id FROM leaderboardentry);",
+    ),
+    ("steps of duplicate match seats", f"DELETE FROM matchstep WHERE player_id IN ({_DUPLICATE_SEATS});"),
+    ("duplicate match seats", f"DELETE FROM matchplayer WHERE id IN ({_DUPLICATE_SEATS});"),
+    (
+        # 舊版先讀 MAX(seq) 再寫入，併發時可能重複；只重編有重複的玩家，保持原順序
+        "steps renumbered in players with duplicate seq",
+        "UPDATE matchstep SET seq = ("
+        "SELECT rn FROM (SELECT id, ROW_NUMBER() OVER ("
+        "PARTITION BY match_id, player_id ORDER BY seq, id) AS rn FROM matchstep) r WHERE r.id = matchstep.id"
+        ") WHERE (match_id, player_id) IN ("
+        "SELECT match_id, player_id FROM matchstep WHERE seq IS NOT NULL "
+        "GROUP BY match_id, player_id, seq HAVING COUNT(*) > 1);",
+    ),
+)
+
+# 唯一索引 -> 找出會讓它建立失敗的重複資料
+_UNIQUE_INDEX_DUPLICATES = {
+    "ux_leaderboardentry_diff_player": "SELECT 1 FROM leaderboardentry GROUP BY difficulty, player HAVING COUNT(*) > 1",
+    "ux_matchplayer_match_name": "SELECT 1 FROM matchplayer GROUP BY match_id, name HAVING COUNT(*) > 1",
+    "ux_matchplayer_match_user": (
+        "SELECT 1 FROM matchplayer WHERE user_id IS NOT NULL GROUP BY match_id, user_id HAVING COUNT(*) > 1"
+    ),
+    "ux_matchstep_match_player_seq": (
+        "SELECT 1 FROM matchstep WHERE seq IS NOT NULL GROUP BY match_id, player_id, seq HAVING COUNT(*) > 1"
+    ),
+}
+
+
+def dedupe_for_unique_indexes(conn: Connection) -> list[tuple[str, int]]:
+    """永久刪除/重編會擋住唯一索引的重複資料，回傳每一步影響的列數 (由 dedupe_data_base.sh 呼叫)"""
+    return [(label, conn.execute(text(sql)).rowcount) for label, sql in _DEDUPE_STATEMENTS]
+
+
+def _check_unique_duplicates(conn: Connection) -> None:
+    """尚未建立的唯一索引若有重複資料擋著就停止啟動，不在 init_db 裡自動刪資料"""
+    existing = {
+        index["name"]
+        for table in ("leaderboardentry", "matchplayer", "matchstep")
+        for index in inspect(conn).get_indexes(table)
+    }
+    blocked = [
+        name for name, sql in _UNIQUE_INDEX_DUPLICATES.items() if name not in existing and conn.execute(text(sql)).first()
+    ]
+    if blocked:
+        raise RuntimeError(
+            f"duplicate rows block the unique indexes {', '.join(blocked)}; back up the database and run "
+            "dedupe_data_base.sh, which permanently removes them"
+        )
+
+
+def _ensure_indexes(conn: Connection) -> None:
+    """create_all 不會替既有資料表補上新索引，這裡逐一檢查並建立"""
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+async def init_db() -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.run_sync(_run_light_migrations)
+        await conn.run_sync(_check_unique_duplicates)
+        await conn.run_sync(_ensure_indexes)
+
+
+# Session 設定只在啟動時組好一次，每個請求直接套用
+SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def get_session() -> AsyncGenerator[AsyncSession, None]:
     """提供 session，搭配 FastAPI Depends 使用"""
-    # 對 SQLite 使用 autocommit 模式以減少鎖
-    with Session(engine, expire_on_commit=False) as session:
+    async with SessionLocal() as session:
         yield session
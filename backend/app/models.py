@@ -1,16 +1,62 @@
 from datetime import datetime
 from enum import Enum
-from typing import Optional
+from typing import Any, Optional
 from sqlmodel import Field, SQLModel
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import DateTime, Index, UniqueConstraint
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+
+class utcnow(FunctionElement):
+    """Current UTC time evaluated by the database (naive, like the rest of the schema)."""
+
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw) -> str:
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utcnow, "sqlite")
+def _utcnow_sqlite(element, compiler, **kw) -> str:
+    # CURRENT_TIMESTAMP only has second precision on SQLite; keep milliseconds for ordering.
+    return "STRFTIME('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+@compiles(utcnow, "postgresql")
+def _utcnow_postgresql(element, compiler, **kw) -> str:
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+def _db_timestamp(on_update: bool = False, **kwargs: Any) -> Any:
+    """Timestamp column stamped by the DB inside the INSERT (and UPDATE if on_update).
+
+    The inline SQL default also covers existing SQLite tables that were created without a
+    DEFAULT clause; the value comes back through RETURNING on flush.
+    """
+    sa_kwargs: dict[str, Any] = {"default": utcnow(), "server_default": utcnow()}
+    if on_update:
+        sa_kwargs["onupdate"] = utcnow()
+    return Field(default=None, sa_column_kwargs=sa_kwargs, **kwargs)
 
 
 class LeaderboardEntry(SQLModel, table=True):
+    # Matches the leaderboard query (WHERE difficulty ORDER BY time_ms, created_at) so rows come back pre-sorted;
+    # one row per (difficulty, player) is the ON CONFLICT target of the best-time upsert;
+    # profile best scores (WHERE player ORDER BY difficulty) read the player index alone.
+    __table_args__ = (
+        Index("ix_leaderboardentry_diff_time_created", "difficulty", "time_ms", "created_at"),
+        Index("ux_leaderboardentry_diff_player", "difficulty", "player", unique=True),
+        Index("ix_leaderboardentry_player_diff_time_created", "player", "difficulty", "time_ms", "created_at"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    player: str = Field(index=True, max_length=50)
-    difficulty: str = Field(index=True)
+    player: str = Field(max_length=50)
+    difficulty: str
     time_ms: int = Field(index=True)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = _db_timestamp()
 
 
 class MatchStatus(str, Enum):
@@ -23,7 +69,7 @@ class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     handle: str = Field(index=True, max_length=50, sa_column_kwargs={"unique": True})
     hashed_password: str
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = _db_timestamp()
 
 
 class Match(SQLModel, table=True):
@@ -34,7 +80,7 @@ class Match(SQLModel, table=True):
     mines: int
     seed: str
     difficulty: Optional[str] = Field(default=None, index=True)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = _db_timestamp()
     started_at: Optional[datetime] = None
     ended_at: Optional[datetime] = None
     countdown_secs: int = Field(default=300)
@@ -42,47 +88,71 @@ class Match(SQLModel, table=True):
 
 
 class MatchPlayer(SQLModel, table=True):
+    # One seat per user / per handle in a match; enforced by the DB so concurrent joins cannot both succeed.
+    # Both also serve WHERE match_id; a user's seats (profile, active-session check) come from (user_id, match_id)
+    # without touching the table before the join to match.
+    __table_args__ = (
+        Index("ux_matchplayer_match_user", "match_id", "user_id", unique=True),
+        Index("ux_matchplayer_match_name", "match_id", "name", unique=True),
+        Index("ix_matchplayer_user_match", "user_id", "match_id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    match_id: int = Field(foreign_key="match.id", index=True)
-    name: str = Field(max_length=50)
-    user_id: Optional[int] = Field(default=None, foreign_key="user.id", index=True)
-    token: str = Field(index=True)
+    match_id: int = Field(foreign_key="match.id")
+    name: str = Field(max_length=50, index=True)
+    user_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    token: str = Field(index=True, unique=True)
     result: Optional[str] = Field(default=None, index=True)  # win/lose/draw/forfeit
     duration_ms: Optional[int] = None
     steps_count: int = Field(default=0)
     finished_at: Optional[datetime] = None
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = _db_timestamp()
     ready: bool = Field(default=False)
     progress: Optional[str] = Field(default=None)  # JSON string of client-provided progress snapshot
+    rank: Optional[int] = Field(default=None)  # final standing, set when the match finishes
+    points: int = Field(default=0)  # rank-board points for that standing, set together with rank
 
 
 class MatchStep(SQLModel, table=True):
+    # One seq per player step (submit_step relies on it to catch a stale counter); also covers WHERE match_id on its own.
+    __table_args__ = (Index("ux_matchstep_match_player_seq", "match_id", "player_id", "seq", unique=True),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    match_id: int = Field(foreign_key="match.id", index=True)
+    match_id: int = Field(foreign_key="match.id")
     player_id: int = Field(foreign_key="matchplayer.id", index=True)
     action: str = Field(max_length=16)  # reveal/flag/chord
     x: int
     y: int
     elapsed_ms: Optional[int] = None
     seq: Optional[int] = Field(default=None, index=True)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = _db_timestamp()
 
 
 class BlogPost(SQLModel, table=True):
+    # 「我的文章」: WHERE user_id ORDER BY created_at
+    __table_args__ = (Index("ix_blogpost_user_created", "user_id", "created_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int = Field(foreign_key="user.id", index=True)
+    user_id: int = Field(foreign_key="user.id")
     title: str = Field(max_length=200)
     content: str = Field()
-    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = _db_timestamp(index=True)
+    updated_at: datetime = _db_timestamp(on_update=True)
+    # 由投票/留言端點在同一交易內維護，列表不必每次彙總
+    upvotes: int = Field(default=0)
+    downvotes: int = Field(default=0)
+    comment_count: int = Field(default=0)
 
 
 class BlogComment(SQLModel, table=True):
+    # 文章內頁留言: WHERE post_id ORDER BY created_at
+    __table_args__ = (Index("ix_blogcomment_post_created", "post_id", "created_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    post_id: int = Field(foreign_key="blogpost.id", index=True)
+    post_id: int = Field(foreign_key="blogpost.id")
     user_id: int = Field(foreign_key="user.id", index=True)
     content: str = Field(max_length=1000)
-    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    created_at: datetime = _db_timestamp(index=True)
 
 
 class BlogVote(SQLModel, table=True):
@@ -92,7 +162,7 @@ class BlogVote(SQLModel, table=True):
     post_id: int = Field(foreign_key="blogpost.id", index=True)
     user_id: int = Field(foreign_key="user.id", index=True)
     value: int = Field(default=0)  # 1 for upvote, -1 for downvote
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = _db_timestamp()
 
 
 class LeaderboardReplay(SQLModel, table=True):
@@ -105,4 +175,4 @@ class LeaderboardReplay(SQLModel, table=True):
     steps_count: int = Field(default=0)
     board_json: str  # JSON: {width,height,mines,seed,safe_start?,difficulty?}
     steps_json: str  # JSON array of steps
-    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    created_at: datetime = _db_timestamp(index=True)
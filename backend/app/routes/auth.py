@@ -1,12 +1,19 @@
 from datetime import datetime, timedelta
+from functools import lru_cache
+import hashlib
+import hmac
+import secrets
+import time
 from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from jose import JWTError, jwt
+import jwt
 from passlib.context import CryptContext
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from ..cache import TTLCache
 from ..config import get_settings
 from ..db import get_session
 from ..models import User
@@ -14,19 +21,46 @@ from ..schemas import Token, UserCreate, UserRead
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-bearer_scheme = HTTPBearer(auto_error=False)
 settings = get_settings()
+# 10 rounds is ~4x cheaper than passlib's default 12; existing 12-round hashes still verify.
+# Test runs drop to the bcrypt minimum so registration fixtures don't dominate suite time.
+pwd_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4 if settings.env == "test" else 10, deprecated="auto")
+bearer_scheme = HTTPBearer(auto_error=False)
+
+# Successful bcrypt checks, keyed by (stored hash, keyed digest of the password) so a
+# changed hash never matches; the process-local key keeps raw password digests out of memory.
+_VERIFIED_CACHE = TTLCache(maxsize=1024, ttl=60)
+_VERIFIED_CACHE_KEY = secrets.token_bytes(32)
+
+# token -> user id, kept no longer than the token's own expiry so repeat requests skip the HMAC check.
+_TOKEN_CACHE = TTLCache(maxsize=4096, ttl=300)
+
+# user id -> User for authenticated requests. No route edits or deletes users, but reset_users.sh deletes them
+# (and restarts the id sequence) behind this process's back; register/login overwrite a reused id's entry here,
+# and the short TTL bounds how long a deleted account keeps authenticating from another worker.
+_USER_CACHE = TTLCache(maxsize=2048, ttl=30)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    digest = hmac.new(_VERIFIED_CACHE_KEY, plain_password.encode(), hashlib.sha256).digest()
+    cache_key = (hashed_password, digest)
+    if _VERIFIED_CACHE.get(cache_key):
+        return True
+    ok = pwd_context.verify(plain_password, hashed_password)
+    if ok:
+        _VERIFIED_CACHE.set(cache_key, True)
+    return ok
 
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+if settings.env == "test":
+    # Reuses one salt per password, which is only acceptable for throwaway test databases.
+    get_password_hash = lru_cache(maxsize=256)(get_password_hash)
+
+
 def _ensure_password_length(password: str) -> None:
     if len(password.encode()) > 72:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Password too long (max 72 bytes)")
@@ -39,41 +73,71 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return jwt.encode(to_encode, settings.jwt_secret, algorithm=settings.jwt_algorithm)
 
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme), session: Session = Depends(get_session)
+def _decode_user_id(token: str) -> Optional[int]:
+    """Return the user id in a valid token, or None if the token is invalid or expired."""
+    user_id = _TOKEN_CACHE.get(token)
+    if user_id is not None:
+        return user_id
+    try:
+        payload = jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
+        user_id = int(payload.get("sub"))
+    except (jwt.PyJWTError, ValueError, TypeError):
+        return None
+    remaining = payload["exp"] - time.time() if isinstance(payload.get("exp"), (int, float)) else 0
+    if remaining > 0:
+        _TOKEN_CACHE.set(token, user_id, ttl=min(remaining, _TOKEN_CACHE.ttl))
+    return user_id
+
+
+def _cache_user(user: User) -> User:
+    """Cache (and hand out) a plain copy outside any session.
+
+    The instance loaded by one request stays bound to that request's session; a rollback there would expire it
+    and every later request served from the cache would fail on attribute access.
+    """
+    snapshot = User(id=user.id, handle=user.handle, hashed_password=user.hashed_password, created_at=user.created_at)
+    _USER_CACHE.set(user.id, snapshot)
+    return snapshot
+
+
+async def _load_user(session: AsyncSession, user_id: int) -> Optional[User]:
+    user = _USER_CACHE.get(user_id)
+    if user is None:
+        user = await session.get(User, user_id)
+        if user:
+            user = _cache_user(user)
+    return user
+
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme), session: AsyncSession = Depends(get_session)
 ) -> User:
     if not credentials or credentials.scheme.lower() != "bearer":
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    token = credentials.credentials
-    try:
-        payload = jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
-        user_id: int = int(payload.get("sub"))
-    except (JWTError, ValueError, TypeError):
+    user_id = _decode_user_id(credentials.credentials)
+    if user_id is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
-    user = session.get(User, user_id)
+    user = await _load_user(session, user_id)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
     return user
 
 
-def get_current_user_optional(
-    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme), session: Session = Depends(get_session)
+async def get_current_user_optional(
+    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme), session: AsyncSession = Depends(get_session)
 ) -> User | None:
     if not credentials or credentials.scheme.lower() != "bearer":
         return None
-    token = credentials.credentials
-    try:
-        payload = jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
-        user_id: int = int(payload.get("sub"))
-    except (JWTError, ValueError, TypeError):
+    user_id = _decode_user_id(credentials.credentials)
+    if user_id is None:
         return None
-    return session.get(User, user_id)
+    return await _load_user(session, user_id)
 
 
 @router.post("/register", response_model=Token)
-async def register(payload: UserCreate, session: Session = Depends(get_session)):
-    existing = session.exec(select(User).where(User.handle == payload.handle)).first()
+async def register(payload: UserCreate, session: AsyncSession = Depends(get_session)):
+    existing = (await session.exec(select(User).where(User.handle == payload.handle))).first()
     if existing:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already taken")
 
@@ -81,21 +145,24 @@ async def register(payload: UserCreate, session: Session = Depends(get_session))
 
     user = User(handle=payload.handle, hashed_password=get_password_hash(payload.password))
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    # The INSERT populates user.id and get_session() sessions do not expire on commit,
+    # so there is nothing to re-SELECT afterwards.
+    await session.commit()
+    _cache_user(user)
 
     access_token = create_access_token({"sub": str(user.id)})
     return {"access_token": access_token, "token_type": "bearer"}
 
 
 @router.post("/login", response_model=Token)
-async def login(payload: UserCreate, session: Session = Depends(get_session)):
-    user = session.exec(select(User).where(User.handle == payload.handle)).first()
+async def login(payload: UserCreate, session: AsyncSession = Depends(get_session)):
+    user = (await session.exec(select(User).where(User.handle == payload.handle))).first()
     _ensure_password_length(payload.password)
     if not user or not verify_password(payload.password, user.hashed_password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
     _ensure_password_length(payload.password)
+    _cache_user(user)
 
     access_token = create_access_token({"sub": str(user.id)})
     return {"access_token": access_token, "token_type": "bearer"}
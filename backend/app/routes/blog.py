@@ -1,13 +1,19 @@
-from typing import Dict, Tuple
-from datetime import datetime
 from pathlib import Path
+from typing import BinaryIO
 from uuid import uuid4
 
-from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, Request
-from sqlalchemy import func, case
-from sqlmodel import Session, select
-
-from ..db import get_session
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import delete, func, null, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ..cache import TTLCache
+from ..db import get_session, is_sqlite
 from ..models import BlogPost, BlogComment, BlogVote, User
 from ..schemas import (
     BlogPostCreate,
@@ -26,103 +32,103 @@ UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
 router = APIRouter(prefix="/api/blog", tags=["blog"])
 
+# sort -> 匿名訪客看到的文章列表 (已序列化 JSON)；登入者有各自的 my_vote，不快取。任何文章/投票/留言寫入都會清空
+_LIST_CACHE = TTLCache(maxsize=4, ttl=30)
 
-def _stats_for_posts(session: Session, post_ids: list[int], user_id: int | None) -> Dict[int, Tuple[int, int, int, int | None]]:
-    if not post_ids:
-        return {}
-
-    vote_rows = session.exec(
-        select(
-            BlogVote.post_id,
-            func.sum(case((BlogVote.value == 1, 1), else_=0)).label("up"),
-            func.sum(case((BlogVote.value == -1, 1), else_=0)).label("down"),
-        ).where(BlogVote.post_id.in_(post_ids)).group_by(BlogVote.post_id)
-    ).all()
-    votes_map: Dict[int, Tuple[int, int]] = {pid: (up or 0, down or 0) for pid, up, down in vote_rows}
 
-    comment_rows = session.exec(
-        select(BlogComment.post_id, func.count().label("count")).where(BlogComment.post_id.in_(post_ids)).group_by(BlogComment.post_id)
-    ).all()
-    comments_map: Dict[int, int] = {pid: cnt for pid, cnt in comment_rows}
+def _post_items_query(user_id: int | None, sort: str | None = None):
+    """文章 + 作者 + 目前使用者的投票，一次查詢取得；sort 為 created/score 時由 DB 排序"""
+    if user_id is not None:
+        my_vote = select(BlogVote.post_id, BlogVote.value).where(BlogVote.user_id == user_id).subquery("my_vote")
+        my_vote_col = my_vote.c.value
+    else:
+        my_vote_col = null()
 
-    my_votes_map: Dict[int, int | None] = {}
+    stmt = select(BlogPost, User.handle, my_vote_col).join(User, BlogPost.user_id == User.id)
     if user_id is not None:
-        my_rows = session.exec(
-            select(BlogVote.post_id, BlogVote.value).where(BlogVote.user_id == user_id, BlogVote.post_id.in_(post_ids))
-        ).all()
-        my_votes_map = {pid: val for pid, val in my_rows}
-
-    result: Dict[int, Tuple[int, int, int, int | None]] = {}
-    for pid in post_ids:
-        up, down = votes_map.get(pid, (0, 0))
-        comments = comments_map.get(pid, 0)
-        my_vote = my_votes_map.get(pid)
-        result[pid] = (up, down, comments, my_vote)
-    return result
-
-
-def _post_to_item(post: BlogPost, author: str, stats: Tuple[int, int, int, int | None]) -> BlogPostItem:
-    up, down, comment_count, my_vote = stats
-    return BlogPostItem(
-        id=post.id,
-        title=post.title,
-        content=post.content,
-        author=author,
-        created_at=post.created_at,
-        updated_at=post.updated_at,
-        upvotes=up,
-        downvotes=down,
-        score=up - down,
-        comment_count=comment_count,
-        my_vote=my_vote,
-    )
+        stmt = stmt.outerjoin(my_vote, my_vote.c.post_id == BlogPost.id)
+    if sort == "score":
+        stmt = stmt.order_by((BlogPost.upvotes - BlogPost.downvotes).desc(), BlogPost.created_at.desc(), BlogPost.id.desc())
+    elif sort == "created":
+        stmt = stmt.order_by(BlogPost.created_at.desc(), BlogPost.id.desc())
+    return stmt
+
+
+def _row_to_item(row) -> BlogPostItem:
+    post, author, my_vote = row
+    return _post_to_item(post, author, my_vote)
+
+
+def _row_to_dict(row) -> dict:
+    post, author, my_vote = row
+    return _post_dict(post, author, my_vote)
+
+
+async def _get_post_item(session: AsyncSession, post_id: int, user_id: int | None) -> BlogPostItem | None:
+    stmt = _post_items_query(user_id).where(BlogPost.id == post_id).execution_options(populate_existing=True)
+    row = (await session.exec(stmt)).first()
+    return _row_to_item(row) if row else None
+
+
+def _post_dict(post: BlogPost, author: str, my_vote: int | None) -> dict:
+    """BlogPostItem 的欄位；列表直接交給 orjson，不逐筆建 Pydantic model"""
+    return {
+        "id": post.id,
+        "title": post.title,
+        "content": post.content,
+        "author": author,
+        "created_at": post.created_at,
+        "updated_at": post.updated_at,
+        "upvotes": post.upvotes,
+        "downvotes": post.downvotes,
+        "score": post.upvotes - post.downvotes,
+        "comment_count": post.comment_count,
+        "my_vote": my_vote,
+    }
+
+
+def _post_to_item(post: BlogPost, author: str, my_vote: int | None) -> BlogPostItem:
+    return BlogPostItem(**_post_dict(post, author, my_vote))
 
 
 @router.get("/posts", response_model=list[BlogPostItem])
 async def list_posts(
     sort: str = Query("created", pattern="^(created|score)$"),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     user=Depends(get_current_user_optional),
 ):
-    stmt = select(BlogPost, User.handle).join(User, BlogPost.user_id == User.id).order_by(BlogPost.created_at.desc()).limit(50)
-    rows = session.exec(stmt).all()
-    posts = [row[0] for row in rows]
-    handles = {row[0].id: row[1] for row in rows if row[0].id is not None}
-    stats = _stats_for_posts(session, [p.id for p in posts if p.id is not None], user.id if user else None)
-
-    if sort == "score":
-        posts.sort(key=lambda p: ((stats.get(p.id, (0, 0, 0, None))[0] - stats.get(p.id, (0, 0, 0, None))[1]), p.created_at), reverse=True)
+    if user:
+        stmt = _post_items_query(user.id, sort).limit(20)
+        return ORJSONResponse([_row_to_dict(row) for row in (await session.exec(stmt)).all()])
 
-    items: list[BlogPostItem] = []
-    for p in posts[:20]:
-        if p.id is None:
-            continue
-        item_stats = stats.get(p.id, (0, 0, 0, None))
-        items.append(_post_to_item(p, handles.get(p.id, "匿名"), item_stats))
-    return items
+    body = _LIST_CACHE.get(sort)
+    if body is None:
+        rows = (await session.exec(_post_items_query(None, sort).limit(20))).all()
+        body = orjson.dumps([_row_to_dict(row) for row in rows])
+        _LIST_CACHE.set(sort, body)
+    return Response(content=body, media_type="application/json")
 
 
 @router.post("/posts", response_model=BlogPostItem)
-async def create_post(payload: BlogPostCreate, session: Session = Depends(get_session), user=Depends(get_current_user)):
+async def create_post(payload: BlogPostCreate, session: AsyncSession = Depends(get_session), user=Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=401, detail="login required")
-    existing_count = session.exec(select(func.count()).select_from(BlogPost).where(BlogPost.user_id == user.id)).one()
+    existing_count = (await session.exec(select(func.count()).select_from(BlogPost).where(BlogPost.user_id == user.id))).one()
     count_val = existing_count[0] if isinstance(existing_count, tuple) else existing_count
     if count_val >= 5:
         raise HTTPException(status_code=400, detail="每位使用者最多可發佈 5 篇文章")
     post = BlogPost(user_id=user.id, title=payload.title, content=payload.content)
     session.add(post)
-    session.commit()
-    session.refresh(post)
-    stats = _stats_for_posts(session, [post.id], user.id)[post.id]
-    return _post_to_item(post, user.handle, stats)
+    await session.commit()
+    _LIST_CACHE.clear()
+    return _post_to_item(post, user.handle, None)
 
 
 @router.put("/posts/{post_id}", response_model=BlogPostItem)
-async def update_post(post_id: int, payload: BlogPostCreate, session: Session = Depends(get_session), user=Depends(get_current_user)):
+async def update_post(post_id: int, payload: BlogPostCreate, session: AsyncSession = Depends(get_session), user=Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=401, detail="login required")
-    post = session.get(BlogPost, post_id)
+    post = await session.get(BlogPost, post_id)
     if not post:
         raise HTTPException(status_code=404, detail="post not found")
     if post.user_id != user.id:
@@ -130,119 +136,139 @@ async def update_post(post_id: int, payload: BlogPostCreate, session: Session =
 
     post.title = payload.title
     post.content = payload.content
-    post.updated_at = datetime.utcnow()
     session.add(post)
-    session.commit()
-    session.refresh(post)
-
-    stats = _stats_for_posts(session, [post.id], user.id)[post.id]
-    return _post_to_item(post, user.handle, stats)
+    await session.commit()
+    _LIST_CACHE.clear()
+    return await _get_post_item(session, post.id, user.id)
 
 
 @router.get("/posts/mine", response_model=list[BlogPostItem])
-async def list_my_posts(session: Session = Depends(get_session), user=Depends(get_current_user)):
+async def list_my_posts(session: AsyncSession = Depends(get_session), user=Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=401, detail="login required")
-    stmt = select(BlogPost).where(BlogPost.user_id == user.id).order_by(BlogPost.created_at.desc())
-    posts = session.exec(stmt).all()
-    stats = _stats_for_posts(session, [p.id for p in posts if p.id is not None], user.id)
-    items: list[BlogPostItem] = []
-    for p in posts:
-        if p.id is None:
-            continue
-        item_stats = stats.get(p.id, (0, 0, 0, None))
-        items.append(_post_to_item(p, user.handle, item_stats))
-    return items
+    stmt = _post_items_query(user.id, "created").where(BlogPost.user_id == user.id)
+    return ORJSONResponse([_row_to_dict(row) for row in (await session.exec(stmt)).all()])
 
 
 @router.get("/posts/{post_id}", response_model=BlogPostDetail)
-async def get_post(post_id: int, session: Session = Depends(get_session), user=Depends(get_current_user_optional)):
-    stmt = select(BlogPost, User.handle).join(User, BlogPost.user_id == User.id).where(BlogPost.id == post_id)
-    row = session.exec(stmt).first()
-    if not row:
+async def get_post(post_id: int, session: AsyncSession = Depends(get_session), user=Depends(get_current_user_optional)):
+    item = await _get_post_item(session, post_id, user.id if user else None)
+    if not item:
         raise HTTPException(status_code=404, detail="post not found")
-    post, author = row
-    stats_map = _stats_for_posts(session, [post.id], user.id if user else None)
-    stats = stats_map.get(post.id, (0, 0, 0, None))
 
-    comment_rows = session.exec(
+    comment_rows = (await session.exec(
         select(BlogComment, User.handle)
         .join(User, BlogComment.user_id == User.id)
-        .where(BlogComment.post_id == post.id)
-        .order_by(BlogComment.created_at.asc())
-    ).all()
+        .where(BlogComment.post_id == item.id)
+        .order_by(BlogComment.created_at.asc(), BlogComment.id.asc())
+    )).all()
     comments = [
         BlogCommentRead(id=c.id, post_id=c.post_id, user_id=c.user_id, author=handle, content=c.content, created_at=c.created_at)
         for c, handle in comment_rows
     ]
 
-    item = _post_to_item(post, author, stats)
     return BlogPostDetail(**item.model_dump(), comments=comments)
 
 
 @router.post("/posts/{post_id}/comments", response_model=BlogCommentRead)
-async def add_comment(post_id: int, payload: BlogCommentCreate, session: Session = Depends(get_session), user=Depends(get_current_user)):
+async def add_comment(post_id: int, payload: BlogCommentCreate, session: AsyncSession = Depends(get_session), user=Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=401, detail="login required")
-    post = session.get(BlogPost, post_id)
+    post = await session.get(BlogPost, post_id)
     if not post:
         raise HTTPException(status_code=404, detail="post not found")
     comment = BlogComment(post_id=post_id, user_id=user.id, content=payload.content)
     session.add(comment)
-    session.commit()
-    session.refresh(comment)
+    # updated_at 設回自身，避免 onupdate 把留言當成文章編輯
+    await session.exec(
+        update(BlogPost)
+        .where(BlogPost.id == post_id)
+        .values(comment_count=BlogPost.comment_count + 1, updated_at=BlogPost.updated_at)
+    )
+    await session.commit()
+    _LIST_CACHE.clear()
     return BlogCommentRead(id=comment.id, post_id=comment.post_id, user_id=comment.user_id, author=user.handle, content=comment.content, created_at=comment.created_at)
 
 
 @router.post("/posts/{post_id}/vote", response_model=BlogPostItem)
-async def vote_post(post_id: int, payload: BlogVoteRequest, session: Session = Depends(get_session), user=Depends(get_current_user)):
+async def vote_post(post_id: int, payload: BlogVoteRequest, session: AsyncSession = Depends(get_session), user=Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=401, detail="login required")
-    post = session.get(BlogPost, post_id)
+    post = await session.get(BlogPost, post_id)
     if not post:
         raise HTTPException(status_code=404, detail="post not found")
 
-    stmt_vote = select(BlogVote).where(BlogVote.post_id == post_id, BlogVote.user_id == user.id)
-    existing = session.exec(stmt_vote).first()
-
     if payload.value == 0:
-        if existing:
-            session.delete(existing)
-            session.commit()
+        await session.exec(delete(BlogVote).where(BlogVote.post_id == post_id, BlogVote.user_id == user.id))
     else:
-        if existing:
-            existing.value = payload.value
-            session.add(existing)
-        else:
-            session.add(BlogVote(post_id=post_id, user_id=user.id, value=payload.value))
-        session.commit()
+        insert = sqlite_insert if is_sqlite else pg_insert
+        stmt = insert(BlogVote).values(post_id=post_id, user_id=user.id, value=payload.value)
+        await session.exec(stmt.on_conflict_do_update(index_elements=["user_id", "post_id"], set_={"value": stmt.excluded.value}))
+
+    # 直接依 blogvote 重算計數 (post_id 有索引)：不必先查舊票，並行投票也不會讓計數漂移
+    up = select(func.count()).where(BlogVote.post_id == post_id, BlogVote.value == 1).scalar_subquery()
+    down = select(func.count()).where(BlogVote.post_id == post_id, BlogVote.value == -1).scalar_subquery()
+    await session.exec(
+        update(BlogPost)
+        .where(BlogPost.id == post_id)
+        .values(upvotes=up, downvotes=down, updated_at=BlogPost.updated_at)  # 投票不算編輯，不觸發 onupdate
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+    _LIST_CACHE.clear()
 
-    session.refresh(post)
-    stats_map = _stats_for_posts(session, [post.id], user.id)
-    stats = stats_map.get(post.id, (0, 0, 0, None))
-    author = session.get(User, post.user_id).handle if post.user_id else "匿名"
-    return _post_to_item(post, author, stats)
+    return await _get_post_item(session, post_id, user.id)
 
 
 @router.delete("/posts/{post_id}", status_code=204)
-async def delete_post(post_id: int, session: Session = Depends(get_session), user=Depends(get_current_user)):
+async def delete_post(post_id: int, session: AsyncSession = Depends(get_session), user=Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=401, detail="login required")
-    post = session.get(BlogPost, post_id)
+    post = await session.get(BlogPost, post_id)
     if not post:
         raise HTTPException(status_code=404, detail="post not found")
     if post.user_id != user.id:
         raise HTTPException(status_code=403, detail="only author can delete")
 
     # remove votes and comments before deleting the post
-    comments = session.exec(select(BlogComment).where(BlogComment.post_id == post_id)).all()
-    for c in comments:
-        session.delete(c)
-    votes = session.exec(select(BlogVote).where(BlogVote.post_id == post_id)).all()
-    for v in votes:
-        session.delete(v)
-    session.delete(post)
-    session.commit()
+    await session.exec(delete(BlogComment).where(BlogComment.post_id == post_id))
+    await session.exec(delete(BlogVote).where(BlogVote.post_id == post_id))
+    await session.delete(post)
+    await session.commit()
+    _LIST_CACHE.clear()
+    return None
+
+
+_MAX_IMAGE_BYTES = 2 * 1024 * 1024
+_UPLOAD_CHUNK = 64 * 1024
+_ALLOWED_IMAGE_TYPES = {"image/png": ".png", "image/jpeg": ".jpg", "image/jpg": ".jpg", "image/gif": ".gif", "image/webp": ".webp"}
+
+
+def _sniff_image_ext(head: bytes) -> str | None:
+    """依檔頭 magic bytes 判斷圖片格式，不信任用戶端的 content_type"""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return ".gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+
+def _copy_upload(src: BinaryIO, dest: Path) -> str | None:
+    """以 64 KiB 分塊寫入，記憶體用量固定；成功回傳 None，否則回傳錯誤訊息並刪除半成品"""
+    total = 0
+    with open(dest, "wb") as f:
+        while chunk := src.read(_UPLOAD_CHUNK):
+            total += len(chunk)
+            if total > _MAX_IMAGE_BYTES:
+                break
+            f.write(chunk)
+    if total > _MAX_IMAGE_BYTES:
+        dest.unlink(missing_ok=True)
+        return "圖片大小上限 2MB"
     return None
 
 
@@ -251,22 +277,21 @@ async def upload_image(request: Request, file: UploadFile = File(...), user=Depe
     if not user:
         raise HTTPException(status_code=401, detail="login required")
 
-    allowed_types = {"image/png": ".png", "image/jpeg": ".jpg", "image/jpg": ".jpg", "image/gif": ".gif", "image/webp": ".webp"}
-    if file.content_type not in allowed_types:
+    if file.content_type not in _ALLOWED_IMAGE_TYPES:
         raise HTTPException(status_code=400, detail="僅支援圖片上傳 (png/jpg/gif/webp)")
 
-    data = await file.read()
-    if len(data) > 2 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="圖片大小上限 2MB")
-
-    ext = Path(file.filename or "").suffix.lower()
-    if ext not in allowed_types.values():
-        ext = allowed_types[file.content_type]
+    head = await file.read(12)
+    ext = _sniff_image_ext(head)
+    if ext is None:
+        raise HTTPException(status_code=400, detail="僅支援圖片上傳 (png/jpg/gif/webp)")
+    await file.seek(0)
 
     filename = f"{uuid4().hex}{ext}"
     dest = UPLOAD_DIR / filename
-    with open(dest, "wb") as f:
-        f.write(data)
+    # 檔案 I/O 一次丟到 threadpool，不阻塞 event loop
+    error = await run_in_threadpool(_copy_upload, file.file, dest)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
 
     base = str(request.base_url).rstrip("/")
     return {"url": f"/uploads/{filename}", "absolute_url": f"{base}/uploads/{filename}"}
@@ -1,72 +1,100 @@
-import json
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlmodel import Session, select
-
-from ..db import get_session
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import Row, bindparam, case
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ..cache import TTLCache
+from ..db import get_session, is_sqlite
 from ..models import LeaderboardEntry, LeaderboardReplay
 from ..schemas import LeaderboardCreate, LeaderboardRead, LeaderboardReplayRead
 from .auth import get_current_user
 
 router = APIRouter(prefix="/api/leaderboard", tags=["leaderboard"])
 
+# difficulty -> top-10 rows pre-serialized as JSON; short TTL bounds staleness across workers, writes evict locally.
+_BOARD_CACHE = TTLCache(maxsize=16, ttl=2)
+_BOARD_SIZE = 10
+
+# entry id -> full /replay response body; a new best time replaces the replay and evicts it locally.
+_REPLAY_CACHE = TTLCache(maxsize=256, ttl=60)
+
+
+def _top_entries_query():
+    # (difficulty, player) is unique, so every row already is that player's best run: the fastest `limit` rows
+    # come straight off the (difficulty, time_ms, created_at) index, which stops after `limit`.
+    return (
+        select(
+            LeaderboardEntry.id,
+            LeaderboardEntry.player,
+            LeaderboardEntry.difficulty,
+            LeaderboardEntry.time_ms,
+            LeaderboardEntry.created_at,
+        )
+        .where(LeaderboardEntry.difficulty == bindparam("difficulty"))
+        .order_by(LeaderboardEntry.time_ms.asc(), LeaderboardEntry.created_at.asc())
+        .limit(bindparam("limit"))
+    )
+
+
+# Built once at import; each call only binds difficulty/limit, and the compiled SQL is reused from the cache.
+_TOP_ENTRIES = _top_entries_query()
 
-def _top_entries(session: Session, difficulty: str, limit: int = 10) -> list[LeaderboardEntry]:
-    query = select(LeaderboardEntry).where(LeaderboardEntry.difficulty == difficulty)
-    query = query.order_by(LeaderboardEntry.time_ms.asc(), LeaderboardEntry.created_at.asc())
-    entries = session.exec(query).all()
 
-    deduped: list[LeaderboardEntry] = []
-    seen_handles: set[str] = set()
-    for entry in entries:
-        if entry.player in seen_handles:
-            continue
-        seen_handles.add(entry.player)
-        deduped.append(entry)
-        if len(deduped) >= limit:
-            break
-    return deduped
+async def _top_entries(session: AsyncSession, difficulty: str, limit: int = 10) -> list[Row]:
+    return list((await session.exec(_TOP_ENTRIES, params={"difficulty": difficulty, "limit": limit})).all())
 
 
 @router.get("", response_model=list[LeaderboardRead])
 async def list_leaderboard(
     difficulty: str = Query(..., description="beginner/intermediate/expert/custom"),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     limit: int = Query(10, ge=1, le=10)
 ):
-    entries = _top_entries(session, difficulty, limit)
+    rows = _BOARD_CACHE.get(difficulty)
+    if rows is None:
+        rows = await _board_rows(session, difficulty)
+        _BOARD_CACHE.set(difficulty, rows)
+    # Rows come straight from the DB, so skip LeaderboardRead validation and emit JSON directly.
+    return Response(content=b"[" + b",".join(rows[:limit]) + b"]", media_type="application/json")
+
+
+async def _board_rows(session: AsyncSession, difficulty: str) -> list[bytes]:
+    entries = await _top_entries(session, difficulty, _BOARD_SIZE)
     entry_ids = [e.id for e in entries if e.id]
     replay_ids: set[int] = set()
     if entry_ids:
         stmt = select(LeaderboardReplay.entry_id).where(LeaderboardReplay.entry_id.in_(entry_ids))
-        replay_ids = set(r for r in session.exec(stmt).all())
-
-    result: list[LeaderboardRead] = []
-    for entry in entries:
-        has_replay = bool(entry.id and entry.id in replay_ids)
-        result.append(
-            LeaderboardRead(
-                id=entry.id,
-                player=entry.player,
-                handle=getattr(entry, "handle", None),
-                difficulty=entry.difficulty,
-                time_ms=entry.time_ms,
-                created_at=entry.created_at,
-                has_replay=has_replay,
-            )
+        replay_ids = set(await session.exec(stmt))
+
+    return [
+        orjson.dumps(
+            {
+                "id": entry.id,
+                "player": entry.player,
+                # create_entry stores the submitting user's handle as player
+                "handle": entry.player,
+                "difficulty": entry.difficulty,
+                "time_ms": entry.time_ms,
+                "created_at": entry.created_at,
+                "has_replay": bool(entry.id and entry.id in replay_ids),
+            }
         )
-    return result
+        for entry in entries
+    ]
 
 
-def _save_replay(session: Session, entry: LeaderboardEntry, payload: LeaderboardCreate) -> None:
+async def _save_replay(session: AsyncSession, entry: Row, payload: LeaderboardCreate) -> None:
     if not payload.replay:
         return
     if not entry.id:
         return
 
-    existing = session.exec(select(LeaderboardReplay).where(LeaderboardReplay.entry_id == entry.id)).first()
+    existing = (await session.exec(select(LeaderboardReplay).where(LeaderboardReplay.entry_id == entry.id))).first()
     if existing:
-        session.delete(existing)
-        session.commit()
+        await session.delete(existing)
 
     replay = LeaderboardReplay(
         entry_id=entry.id,
@@ -75,59 +103,60 @@ def _save_replay(session: Session, entry: LeaderboardEntry, payload: Leaderboard
         time_ms=entry.time_ms,
         duration_ms=payload.replay.duration_ms,
         steps_count=len(payload.replay.steps),
-        board_json=json.dumps(payload.replay.board.model_dump()),
-        steps_json=json.dumps([step.model_dump() for step in payload.replay.steps]),
+        # Compact orjson output: no ", "/": " padding per step, and faster than json.dumps. Served back verbatim.
+        board_json=orjson.dumps(payload.replay.board.model_dump()).decode(),
+        steps_json=orjson.dumps([step.model_dump() for step in payload.replay.steps]).decode(),
     )
     session.add(replay)
-    session.commit()
+
+
+def _upsert_best_time(handle: str, difficulty: str, time_ms: int):
+    """One atomic statement: insert the player's first run, or keep the faster of the stored and new time."""
+    insert = sqlite_insert if is_sqlite else pg_insert
+    stmt = insert(LeaderboardEntry).values(player=handle, difficulty=difficulty, time_ms=time_ms)
+    best = case((stmt.excluded.time_ms < LeaderboardEntry.time_ms, stmt.excluded.time_ms), else_=LeaderboardEntry.time_ms)
+    return stmt.on_conflict_do_update(index_elements=["difficulty", "player"], set_={"time_ms": best}).returning(
+        LeaderboardEntry.id,
+        LeaderboardEntry.player,
+        LeaderboardEntry.difficulty,
+        LeaderboardEntry.time_ms,
+        LeaderboardEntry.created_at,
+    )
 
 
 @router.post("", response_model=LeaderboardRead)
-async def create_entry(payload: LeaderboardCreate, session: Session = Depends(get_session), user=Depends(get_current_user)):
+async def create_entry(payload: LeaderboardCreate, session: AsyncSession = Depends(get_session), user=Depends(get_current_user)):
     if payload.time_ms <= 0:
         raise HTTPException(status_code=400, detail="time_ms must be positive")
     if not user:
         raise HTTPException(status_code=401, detail="login required")
 
     handle = user.handle
-    existing = session.exec(
-        select(LeaderboardEntry).where(LeaderboardEntry.difficulty == payload.difficulty, LeaderboardEntry.player == handle)
-    ).first()
-
-    if existing:
-        if payload.time_ms < existing.time_ms:
-            existing.time_ms = payload.time_ms
-            session.add(existing)
-            session.commit()
-            session.refresh(existing)
-            entry = existing
-        else:
-            entry = existing
-    else:
-        entry = LeaderboardEntry(
-            player=handle,
-            difficulty=payload.difficulty,
-            time_ms=payload.time_ms,
-        )
-        session.add(entry)
-        session.commit()
-        session.refresh(entry)
+    # Not committed yet: entry + replay are committed together in a single transaction.
+    entry = (await session.exec(_upsert_best_time(handle, payload.difficulty, payload.time_ms))).one()
 
     # Ensure top-10 entries have replay data.
-    top_entries = _top_entries(session, payload.difficulty, 10)
+    top_entries = await _top_entries(session, payload.difficulty, 10)
     top_ids = {e.id for e in top_entries if e.id}
     if entry.id in top_ids:
         if not payload.replay:
+            await session.commit()
+            _BOARD_CACHE.pop(payload.difficulty)
             raise HTTPException(status_code=400, detail="replay required for top 10 entries")
-        _save_replay(session, entry, payload)
+        await _save_replay(session, entry, payload)
     elif payload.replay:
         # Still accept replay even if not top-10 yet; will be used if later promoted.
-        _save_replay(session, entry, payload)
+        await _save_replay(session, entry, payload)
 
     has_replay = bool(entry.id and entry.id in top_ids)
     replay_exists = False
     if entry.id:
-        replay_exists = session.exec(select(LeaderboardReplay).where(LeaderboardReplay.entry_id == entry.id)).first() is not None
+        replay_exists = (
+            await session.exec(select(LeaderboardReplay).where(LeaderboardReplay.entry_id == entry.id))
+        ).first() is not None
+    await session.commit()
+    _BOARD_CACHE.pop(payload.difficulty)
+    _REPLAY_CACHE.pop(entry.id)
     return LeaderboardRead(
         id=entry.id,
         player=entry.player,
@@ -140,24 +169,39 @@ async def create_entry(payload: LeaderboardCreate, session: Session = Depends(ge
 
 
 @router.get("/{entry_id}/replay", response_model=LeaderboardReplayRead)
-async def get_replay(entry_id: int, session: Session = Depends(get_session)):
-    entry = session.get(LeaderboardEntry, entry_id)
-    if not entry:
+async def get_replay(entry_id: int, session: AsyncSession = Depends(get_session)):
+    body = _REPLAY_CACHE.get(entry_id)
+    if body is None:
+        body = await _replay_body(session, entry_id)
+        _REPLAY_CACHE.set(entry_id, body)
+    return Response(content=body, media_type="application/json")
+
+
+async def _replay_body(session: AsyncSession, entry_id: int) -> bytes:
+    # Entry and its replay in one round trip; the outer join tells a missing entry from a missing replay.
+    stmt = (
+        select(LeaderboardEntry.player, LeaderboardEntry.difficulty, LeaderboardReplay)
+        .outerjoin(LeaderboardReplay, LeaderboardReplay.entry_id == LeaderboardEntry.id)
+        .where(LeaderboardEntry.id == entry_id)
+    )
+    row = (await session.exec(stmt)).first()
+    if not row:
         raise HTTPException(status_code=404, detail="entry not found")
-    replay = session.exec(select(LeaderboardReplay).where(LeaderboardReplay.entry_id == entry_id)).first()
+    player, difficulty, replay = row
     if not replay:
         raise HTTPException(status_code=404, detail="replay not found")
 
-    board = json.loads(replay.board_json)
-    steps = json.loads(replay.steps_json)
-    return LeaderboardReplayRead(
-        entry_id=entry_id,
-        player=entry.player,
-        difficulty=entry.difficulty,
-        board=board,
-        steps=steps,
-        time_ms=replay.time_ms,
-        duration_ms=replay.duration_ms,
-        steps_count=replay.steps_count,
-        created_at=replay.created_at,
+    # board/steps are stored as JSON text already; embed them as-is instead of parsing and re-serializing.
+    return orjson.dumps(
+        {
+            "entry_id": entry_id,
+            "player": player,
+            "difficulty": difficulty,
+            "board": orjson.Fragment(replay.board_json),
+            "steps": orjson.Fragment(replay.steps_json),
+            "time_ms": replay.time_ms,
+            "duration_ms": replay.duration_ms,
+            "steps_count": replay.steps_count,
+            "created_at": replay.created_at,
+        }
     )
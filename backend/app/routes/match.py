@@ -1,11 +1,17 @@
 from datetime import datetime, timedelta
 import hashlib
-import json
+import orjson
 import secrets
-from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, select
-
+from typing import Any, Optional
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.responses import ORJSONResponse
+from pydantic import TypeAdapter
+from sqlalchemy import Integer, case, delete, func, insert, lambda_stmt, literal, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ..cache import TTLCache
 from ..db import get_session
 from ..models import Match, MatchPlayer, MatchStatus, MatchStep
 from ..schemas import (
@@ -16,7 +22,6 @@ from ..schemas import (
     MatchJoin,
     MatchJoinResponse,
     MatchState,
-    MatchStatePlayer,
     MatchStepCreate,
     MatchStepRead,
     MatchReady,
@@ -30,22 +35,32 @@ from .auth import get_current_user
 router = APIRouter(prefix="/api/match", tags=["match"])
 
 IDLE_MINUTES = 10
+_JOINABLE_STATUSES = frozenset({MatchStatus.pending, MatchStatus.active})
+
+# player id -> (raw progress text, parsed snapshot): one entry per player, sized for the players polling at once.
+_PROGRESS_CACHE = TTLCache(maxsize=256, ttl=60)
 
+# Polling endpoints build their schemas from DB rows with model_construct (no validation) and serialize them here
+# directly, so FastAPI doesn't dump and re-validate the response; response_model still documents the shape.
+_HISTORY_JSON = TypeAdapter(list[MatchHistoryItem])
+_RECENT_JSON = TypeAdapter(list[RecentMatch])
 
-def _touch_match(match: Match) -> None:
-    """Update last_active_at to now."""
-    match.last_active_at = datetime.utcnow()
 
+def _touch_match(match: Match, now: datetime) -> None:
+    """Update last_active_at to the request's now."""
+    match.last_active_at = now
 
-def _active_session_for_user(session: Session, user_id: int, exclude_match_ids: Optional[list[int]] = None) -> Optional[tuple[Match, MatchPlayer]]:
+
+async def _active_session_for_user(session: AsyncSession, user_id: int, now: datetime, exclude_match_ids: Optional[list[int]] = None) -> Optional[tuple[Match, MatchPlayer]]:
     exclude_match_ids = exclude_match_ids or []
     stmt = select(MatchPlayer, Match).join(Match, MatchPlayer.match_id == Match.id).where(
         MatchPlayer.user_id == user_id,
         Match.status != MatchStatus.finished,
     )
-    rows = session.exec(stmt).all()
+    rows = (await session.exec(stmt)).all()
+    matches = list({match.id: match for _, match in rows}.values())
+    await _apply_timeouts(session, matches, now)
     for player, match in rows:
-        _apply_timeout(session, match)
         if match.status == MatchStatus.finished:
             continue
         if match.id in exclude_match_ids:
@@ -71,16 +86,30 @@ def _safe_start(match: Match) -> dict[str, int]:
     return {"x": x, "y": y}
 
 
-def _get_match(session: Session, match_id: int) -> Match:
-    match = session.get(Match, match_id)
+async def _get_match(session: AsyncSession, match_id: int) -> Match:
+    match = await session.get(Match, match_id)
     if not match:
         raise HTTPException(status_code=404, detail="match not found")
     return match
 
 
-def _get_player_by_token(session: Session, token: str) -> Optional[MatchPlayer]:
-    stmt = select(MatchPlayer).where(MatchPlayer.token == token)
-    return session.exec(stmt).first()
+async def _load_match_context(session: AsyncSession, match_id: int, token: str) -> tuple[Match, list[MatchPlayer], MatchPlayer]:
+    """Match, all of its players and the token's player in one round trip (replaces get_match + by_token + list_players)."""
+    stmt = (
+        select(Match, MatchPlayer)
+        .outerjoin(MatchPlayer, MatchPlayer.match_id == Match.id)
+        .where(Match.id == match_id)
+        .order_by(MatchPlayer.created_at, MatchPlayer.id)
+    )
+    rows = (await session.exec(stmt)).all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="match not found")
+    match = rows[0][0]
+    players = [p for _, p in rows if p is not None]
+    player = next((p for p in players if p.token == token), None)
+    if not player:
+        raise HTTPException(status_code=403, detail="invalid player token")
+    return match, players, player
 
 
 def _progress_stats(progress: Optional[dict]) -> tuple[int, bool]:
@@ -103,11 +132,9 @@ def _progress_stats(progress: Optional[dict]) -> tuple[int, bool]:
     return revealed, hit_mine
 
 
-def _ensure_joinable(session: Session, match: Match) -> None:
-    if match.status not in {MatchStatus.pending, MatchStatus.active}:
+def _ensure_joinable(match: Match) -> None:
+    if match.status not in _JOINABLE_STATUSES:
         raise HTTPException(status_code=400, detail="match already finished")
-    stmt = select(MatchPlayer).where(MatchPlayer.match_id == match.id)
-    players = session.exec(stmt).all()
     # allow multiple players; optionally cap here if desired
 
 
@@ -119,51 +146,87 @@ def _select_host(players: list[MatchPlayer]) -> Optional[int]:
     return players_sorted[0].id
 
 
-def _list_players(session: Session, match: Match) -> list[MatchPlayer]:
-    stmt = select(MatchPlayer).where(MatchPlayer.match_id == match.id)
-    return session.exec(stmt).all()
-
-
-def _remove_player(session: Session, match: Match, player: MatchPlayer) -> None:
-    steps_stmt = select(MatchStep).where(MatchStep.match_id == match.id, MatchStep.player_id == player.id)
-    for step in session.exec(steps_stmt):
-        session.delete(step)
-    session.delete(player)
-    session.commit()
-    session.refresh(match)
-
-
-def _player_to_schema(player: MatchPlayer) -> MatchStatePlayer:
-    progress = None
-    if player.progress:
-        try:
-            progress = json.loads(player.progress)
-        except json.JSONDecodeError:
-            progress = None
-    rank = getattr(player, "_rank", None)
-    return MatchStatePlayer(
-        id=player.id,
-        name=player.name,
-        result=player.result,
-        duration_ms=player.duration_ms,
-        steps_count=player.steps_count,
-        finished_at=player.finished_at,
-        ready=player.ready,
-        rank=rank,
-        progress=progress,
+async def _list_players(session: AsyncSession, match: Match) -> list[MatchPlayer]:
+    match_id = match.id
+    stmt = lambda_stmt(
+        lambda: select(MatchPlayer).where(MatchPlayer.match_id == match_id).order_by(MatchPlayer.created_at, MatchPlayer.id)
     )
+    return (await session.exec(stmt)).scalars().all()
+
+
+async def _remove_player(session: AsyncSession, match: Match, player: MatchPlayer) -> None:
+    # Executed right away (not deferred to flush), so the rows are gone before the caller may delete the match.
+    await session.exec(delete(MatchStep).where(MatchStep.match_id == match.id, MatchStep.player_id == player.id))
+    await session.exec(delete(MatchPlayer).where(MatchPlayer.id == player.id))
+
+
+def _decode_progress(player: MatchPlayer) -> Optional[dict]:
+    """Parsed progress snapshot. /state polls re-read the same blob, so each player's latest parse is kept
+    (a new snapshot replaces it) and reused while the raw text is unchanged. Treat as read-only."""
+    raw = player.progress
+    if not raw:
+        return None
+    cached = _PROGRESS_CACHE.get(player.id)
+    if cached is not None and cached[0] == raw:
+        return cached[1]
+    try:
+        progress = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        progress = None
+    _PROGRESS_CACHE.set(player.id, (raw, progress))
+    return progress
+
+
+def _player_state(player: MatchPlayer) -> dict[str, Any]:
+    """One MatchStatePlayer entry as a plain dict; /state hands these straight to orjson."""
+    return {
+        "id": player.id,
+        "name": player.name,
+        "result": player.result,
+        "duration_ms": player.duration_ms,
+        "steps_count": player.steps_count,
+        "finished_at": player.finished_at,
+        "ready": player.ready,
+        "rank": player.rank,
+        "progress": _decode_progress(player),
+    }
 
 
-def _compute_standings(match: Match, players: list[MatchPlayer]) -> list[tuple[int, MatchPlayer]]:
-    """Return list of (rank, player) sorted by outcome rules."""
+def _points_for(rank: int, total: int) -> int:
+    """Rank-board points for finishing `rank` out of `total` players."""
+    if total < 2:
+        return 0
+    if total == 2:
+        base = [10, 2]
+        return base[rank - 1] if rank <= 2 else 1
+    if total == 3:
+        base = [14, 7, 2]
+        return base[rank - 1] if rank <= 3 else 1
+    if total == 4:
+        base = [18, 10, 5, 2]
+        return base[rank - 1] if rank <= 4 else 1
+    value = round(25 * (1 - (rank - 1) / total) ** 1.1) + 1
+    return max(value, 1)
+
+
+def _settle_ranks(match: Match, players: list[MatchPlayer]) -> None:
+    """Store each player's final standing and its points; profile stats and the rank board aggregate these."""
+    total = len(players)
+    for r, p in _compute_standings(match, players):
+        p.rank = r
+        p.points = _points_for(r, total)
+
+
+def _compute_standings(
+    match: Match, players: list[MatchPlayer], results: Optional[dict[int, str]] = None
+) -> list[tuple[int, MatchPlayer]]:
+    """Return list of (rank, player) sorted by outcome rules; `results` (player id -> result) overrides p.result."""
     standings: list[tuple[bool, int, int, int, datetime, MatchPlayer]] = []
     for p in players:
-        try:
-            progress = json.loads(p.progress) if p.progress else None
-        except json.JSONDecodeError:
-            progress = None
+        progress = _decode_progress(p)
         revealed, hit_mine = _progress_stats(progress)
-        explicit_lose = p.result == "lose"
+        result = results.get(p.id, p.result) if results else p.result
+        explicit_lose = result == "lose"
         hit_flag = hit_mine or explicit_lose
         duration = p.duration_ms if p.duration_ms is not None else 10**12
         steps = p.steps_count
@@ -180,31 +243,43 @@ def _compute_standings(match: Match, players: list[MatchPlayer]) -> list[tuple[i
     return ranked
 
 
-def _apply_timeout(session: Session, match: Match) -> list[MatchPlayer]:
-    players = _list_players(session, match)
-    now = datetime.utcnow()
+def _idle_expired(match: Match, now: datetime) -> bool:
+    """No activity for IDLE_MINUTES."""
+    last_active = match.last_active_at or match.created_at
+    return bool(last_active) and now >= last_active + timedelta(minutes=IDLE_MINUTES)
+
+
+def _deadline_passed(match: Match, now: datetime) -> bool:
+    if not match.started_at:
+        return False
+    countdown_secs = match.countdown_secs or _default_countdown(match.difficulty)
+    return now >= match.started_at + timedelta(seconds=countdown_secs)
+
+
+def _timeout_due(match: Match, now: datetime) -> bool:
+    """Cheap check on the match row alone; players only need loading when this is True."""
+    return match.status != MatchStatus.finished and (_idle_expired(match, now) or _deadline_passed(match, now))
+
+
+def _timeout_match(match: Match, players: list[MatchPlayer], now: datetime) -> bool:
+    """Close an idle or timed-out match in memory; returns True if anything changed (the caller commits)."""
+    if match.status == MatchStatus.finished:
+        return False
 
     # Idle auto-close for matches with no activity for IDLE_MINUTES.
-    last_active = match.last_active_at or match.created_at
-    if match.status != MatchStatus.finished and last_active and now >= last_active + timedelta(minutes=IDLE_MINUTES):
+    if _idle_expired(match, now):
         for p in players:
             if not p.result:
                 p.result = "forfeit"
                 p.finished_at = now
         match.status = MatchStatus.finished
         match.ended_at = now
-        _touch_match(match)
-        session.commit()
-        session.refresh(match)
-        return _list_players(session, match)
+        _touch_match(match, now)
+        _settle_ranks(match, players)
+        return True
 
-    if match.status == MatchStatus.finished or not match.started_at:
-        return players
-
-    countdown_secs = match.countdown_secs or _default_countdown(match.difficulty)
-    deadline = match.started_at + timedelta(seconds=countdown_secs)
-    if now < deadline:
-        return players
+    if not _deadline_passed(match, now):
+        return False
 
     unfinished = [p for p in players if not p.result]
     if unfinished:
@@ -218,28 +293,61 @@ def _apply_timeout(session: Session, match: Match) -> list[MatchPlayer]:
                 p.finished_at = now
     match.status = MatchStatus.finished
     match.ended_at = now
+    _touch_match(match, now)
+    _settle_ranks(match, players)
+    return True
+
 
-    _touch_match(match)
-    session.commit()
-    session.refresh(match)
-    players = _list_players(session, match)
-    ranked = _compute_standings(match, players)
-    for r, p in ranked:
-        p._rank = r
+async def _apply_timeout(session: AsyncSession, match: Match, now: datetime, players: Optional[list[MatchPlayer]] = None) -> list[MatchPlayer]:
+    if players is None:
+        players = await _list_players(session, match)
+    # expire_on_commit=False: the in-memory rows already hold the committed values, no re-select needed.
+    if _timeout_match(match, players, now):
+        await session.commit()
     return players
 
 
+async def _players_by_match(session: AsyncSession, match_ids: list[int]) -> dict[int, list[MatchPlayer]]:
+    players_by_match: dict[int, list[MatchPlayer]] = {mid: [] for mid in match_ids}
+    if match_ids:
+        stmt = select(MatchPlayer).where(MatchPlayer.match_id.in_(match_ids)).order_by(MatchPlayer.created_at, MatchPlayer.id)
+        for player in (await session.exec(stmt)).all():
+            players_by_match.setdefault(player.match_id, []).append(player)
+    return players_by_match
+
+
+async def _apply_timeouts(
+    session: AsyncSession,
+    matches: list[Match],
+    now: datetime,
+    players_by_match: Optional[dict[int, list[MatchPlayer]]] = None,
+) -> None:
+    """Batch form of _apply_timeout for list endpoints: all changes share one commit, and no commit when nothing is due.
+
+    Players are only fetched (one IN query) for the matches that are actually due, unless the caller already has them.
+    """
+    due = [m for m in matches if _timeout_due(m, now)]
+    if not due:
+        return
+    if players_by_match is None:
+        players_by_match = await _players_by_match(session, [m.id for m in due])
+    for match in due:
+        _timeout_match(match, players_by_match.get(match.id, []), now)
+    await session.commit()
+
+
 @router.get("/my-active", response_model=ActiveMatchResponse)
-async def get_my_active_match(session: Session = Depends(get_session), user=Depends(get_current_user)):
+async def get_my_active_match(session: AsyncSession = Depends(get_session), user=Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=401, detail="login required")
 
-    active = _active_session_for_user(session, user.id)
+    now = datetime.utcnow()
+    active = await _active_session_for_user(session, user.id, now)
     if not active:
         return ActiveMatchResponse(active=False)
 
     match, player = active
-    players = _apply_timeout(session, match)
+    players = await _apply_timeout(session, match, now)
     if match.status == MatchStatus.finished:
         return ActiveMatchResponse(active=False)
 
@@ -258,10 +366,11 @@ async def get_my_active_match(session: Session = Depends(get_session), user=Depe
 
 
 @router.post("", response_model=MatchCreateResponse)
-async def create_match(payload: MatchCreate, session: Session = Depends(get_session), user=Depends(get_current_user)):
+async def create_match(payload: MatchCreate, session: AsyncSession = Depends(get_session), user=Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=401, detail="login required")
-    active = _active_session_for_user(session, user.id)
+    now = datetime.utcnow()
+    active = await _active_session_for_user(session, user.id, now)
     if active:
         match, player = active
         raise HTTPException(
@@ -277,17 +386,15 @@ async def create_match(payload: MatchCreate, session: Session = Depends(get_sess
         difficulty=payload.difficulty,
         countdown_secs=countdown_secs,
     )
+    _touch_match(match, now)
     session.add(match)
-    session.commit()
-    session.refresh(match)
-    _touch_match(match)
+    # flush 只為取得 match.id (無 fsync)；match 與 player 在同一交易一次 commit
+    await session.flush()
 
     token = secrets.token_urlsafe(16)
     player = MatchPlayer(match_id=match.id, name=user.handle, user_id=user.id, token=token)
     session.add(player)
-    _touch_match(match)
-    session.commit()
-    session.refresh(player)
+    await session.commit()
 
     return MatchCreateResponse(
         countdown_secs=match.countdown_secs,
@@ -299,15 +406,26 @@ async def create_match(payload: MatchCreate, session: Session = Depends(get_sess
     )
 
 
+def _join_response(match: Match, player_id: int, token: str, host_id: Optional[int]) -> MatchJoinResponse:
+    return MatchJoinResponse(
+        match_id=match.id,
+        player_id=player_id,
+        player_token=token,
+        board={"width": match.width, "height": match.height, "mines": match.mines, "seed": match.seed, "safe_start": _safe_start(match)},
+        host_id=host_id,
+    )
+
+
 @router.post("/{match_id}/join", response_model=MatchJoinResponse)
-async def join_match(match_id: int, session: Session = Depends(get_session), user=Depends(get_current_user)):
+async def join_match(match_id: int, session: AsyncSession = Depends(get_session), user=Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=401, detail="login required")
-    match = _get_match(session, match_id)
-    _ensure_joinable(session, match)
+    now = datetime.utcnow()
+    match = await _get_match(session, match_id)
+    _ensure_joinable(match)
 
     # Block joining other matches if user already has an active one.
-    active_elsewhere = _active_session_for_user(session, user.id, exclude_match_ids=[match.id])
+    active_elsewhere = await _active_session_for_user(session, user.id, now, exclude_match_ids=[match.id])
     if active_elsewhere:
         active_match, active_player = active_elsewhere
         raise HTTPException(
@@ -315,19 +433,19 @@ async def join_match(match_id: int, session: Session = Depends(get_session), use
             detail={"message": "already in another active match", "match_id": active_match.id, "player_id": active_player.id, "player_token": active_player.token},
         )
 
-    existing_players = _list_players(session, match)
+    # Only the columns the join checks and host pick need; progress snapshots can be large.
+    match_pk = match.id
+    seats_stmt = lambda_stmt(
+        lambda: select(MatchPlayer.id, MatchPlayer.user_id, MatchPlayer.name, MatchPlayer.token, MatchPlayer.created_at).where(
+            MatchPlayer.match_id == match_pk
+        ).order_by(MatchPlayer.created_at, MatchPlayer.id)
+    )
+    existing_players = (await session.exec(seats_stmt)).all()
     existing_same_user = next((p for p in existing_players if p.user_id == user.id), None)
     if existing_same_user:
-        _touch_match(match)
-        session.commit()
-        session.refresh(existing_same_user)
-        return MatchJoinResponse(
-            match_id=match.id,
-            player_id=existing_same_user.id,
-            player_token=existing_same_user.token,
-            board={"width": match.width, "height": match.height, "mines": match.mines, "seed": match.seed, "safe_start": _safe_start(match)},
-            host_id=_select_host(existing_players),
-        )
+        _touch_match(match, now)
+        await session.commit()
+        return _join_response(match, existing_same_user.id, existing_same_user.token, _select_host(existing_players))
     if any(p.name == user.handle for p in existing_players):
         raise HTTPException(status_code=400, detail="handle already in match")
 
@@ -335,44 +453,42 @@ async def join_match(match_id: int, session: Session = Depends(get_session), use
     player = MatchPlayer(match_id=match.id, name=user.handle, user_id=user.id, token=token)
     session.add(player)
 
-    _touch_match(match)
-    session.commit()
-    session.refresh(player)
-    session.refresh(match)
+    _touch_match(match, now)
+    try:
+        await session.commit()
+    except IntegrityError:
+        # A concurrent join took a seat between the check above and this insert. If it was this user's own
+        # (a double-submitted join), hand that seat back like a rejoin; only another user's clash on the handle fails.
+        await session.rollback()
+        existing_players = (await session.exec(seats_stmt)).all()
+        existing_same_user = next((p for p in existing_players if p.user_id == user.id), None)
+        if not existing_same_user:
+            raise HTTPException(status_code=400, detail="handle already in match")
+        await session.refresh(match)  # the rollback expired it
+        return _join_response(match, existing_same_user.id, existing_same_user.token, _select_host(existing_players))
 
-    return MatchJoinResponse(
-        match_id=match.id,
-        player_id=player.id,
-        player_token=token,
-        board={"width": match.width, "height": match.height, "mines": match.mines, "seed": match.seed, "safe_start": _safe_start(match)},
-        host_id=_select_host(_list_players(session, match)),
-    )
+    # The new player joined last, so it only becomes host of an otherwise empty match.
+    return _join_response(match, player.id, token, _select_host(existing_players) if existing_players else player.id)
 
 
 @router.post("/{match_id}/ready")
-async def set_ready(match_id: int, payload: MatchReady, session: Session = Depends(get_session)):
-    match = _get_match(session, match_id)
-    player = _get_player_by_token(session, payload.player_token)
-    if not player or player.match_id != match.id:
-        raise HTTPException(status_code=403, detail="invalid player token")
+async def set_ready(match_id: int, payload: MatchReady, session: AsyncSession = Depends(get_session)):
+    now = datetime.utcnow()
+    match, players, player = await _load_match_context(session, match_id, payload.player_token)
     if match.status == MatchStatus.finished:
         raise HTTPException(status_code=400, detail="match finished")
 
     player.ready = payload.ready
-    _touch_match(match)
-    session.commit()
-    session.refresh(match)
+    _touch_match(match, now)
+    await session.commit()
     return {"ok": True, "status": match.status.value, "started_at": match.started_at, "countdown_secs": match.countdown_secs}
 
 
 @router.post("/{match_id}/start")
-async def start_match(match_id: int, payload: MatchReady, session: Session = Depends(get_session)):
-    match = _get_match(session, match_id)
-    player = _get_player_by_token(session, payload.player_token)
-    if not player or player.match_id != match.id:
-        raise HTTPException(status_code=403, detail="invalid player token")
+async def start_match(match_id: int, payload: MatchReady, session: AsyncSession = Depends(get_session)):
+    now = datetime.utcnow()
+    match, players, player = await _load_match_context(session, match_id, payload.player_token)
 
-    players = _list_players(session, match)
     host_id = _select_host(players)
     if host_id != player.id:
         raise HTTPException(status_code=403, detail="only host can start")
@@ -383,111 +499,138 @@ async def start_match(match_id: int, payload: MatchReady, session: Session = Dep
     if len(players) < 2:
         raise HTTPException(status_code=400, detail="need at least two players to start")
 
-    now = datetime.utcnow()
     start_delay = 10
     match.status = MatchStatus.active
     match.started_at = match.started_at or now + timedelta(seconds=start_delay)
     if not match.countdown_secs:
         match.countdown_secs = _default_countdown(match.difficulty)
 
-    _touch_match(match)
-    session.commit()
-    session.refresh(match)
+    _touch_match(match, now)
+    await session.commit()
     return {"ok": True, "status": match.status.value, "started_at": match.started_at, "countdown_secs": match.countdown_secs}
 
 
 @router.get("/{match_id}/state", response_model=MatchState)
-async def get_match_state(match_id: int, session: Session = Depends(get_session)):
-    match = _get_match(session, match_id)
-    players = _apply_timeout(session, match)
+async def get_match_state(match_id: int, session: AsyncSession = Depends(get_session)):
+    now = datetime.utcnow()
+    match = await _get_match(session, match_id)
+    players = await _apply_timeout(session, match, now)
     countdown_secs = match.countdown_secs or _default_countdown(match.difficulty)
-    ranked = _compute_standings(match, players) if match.status == MatchStatus.finished else None
-    if ranked:
-        for r, p in ranked:
-            p._rank = r
 
-    return MatchState(
-        id=match.id,
-        status=match.status.value,
-        width=match.width,
-        height=match.height,
-        mines=match.mines,
-        seed=match.seed,
-        difficulty=match.difficulty,
-        created_at=match.created_at,
-        started_at=match.started_at,
-        ended_at=match.ended_at,
-        countdown_secs=countdown_secs,
-        safe_start=_safe_start(match),
-        host_id=_select_host(players),
-        players=[_player_to_schema(p) for p in players],
+    # The most-polled endpoint: one dict (no per-player model instances) serialized by orjson in a single pass.
+    return ORJSONResponse(
+        {
+            "id": match.id,
+            "status": match.status.value,
+            "width": match.width,
+            "height": match.height,
+            "mines": match.mines,
+            "seed": match.seed,
+            "difficulty": match.difficulty,
+            "created_at": match.created_at,
+            "started_at": match.started_at,
+            "ended_at": match.ended_at,
+            "countdown_secs": countdown_secs,
+            "safe_start": _safe_start(match),
+            "host_id": _select_host(players),
+            "players": [_player_state(p) for p in players],
+        }
     )
 
 
 @router.post("/{match_id}/step")
-async def submit_step(match_id: int, payload: MatchStepCreate, session: Session = Depends(get_session)):
-    match = _get_match(session, match_id)
-    player = _get_player_by_token(session, payload.player_token)
-    if not player or player.match_id != match.id:
-        raise HTTPException(status_code=403, detail="invalid player token")
-    players = _apply_timeout(session, match)
+async def submit_step(match_id: int, payload: MatchStepCreate, session: AsyncSession = Depends(get_session)):
+    now = datetime.utcnow()
+    match, players, player = await _load_match_context(session, match_id, payload.player_token)
+    players = await _apply_timeout(session, match, now, players)
     if match.status != MatchStatus.active:
         raise HTTPException(status_code=400, detail="match not active")
     # Allow slight clock drift: accept steps as soon as match is active, even if local clock is ahead of server start_at.
 
-    stmt = select(MatchStep).where(MatchStep.match_id == match.id, MatchStep.player_id == player.id).order_by(MatchStep.seq.desc())
-    last_step = session.exec(stmt).first()
-    next_seq = (last_step.seq or 0) + 1 if last_step else 1
-
-    step = MatchStep(
-        match_id=match.id,
-        player_id=player.id,
-        action=payload.action,
-        x=payload.x,
-        y=payload.y,
-        elapsed_ms=payload.elapsed_ms,
-        seq=next_seq,
-    )
-    player.steps_count = next_seq
-    session.add(step)
-    _touch_match(match)
-    session.commit()
+    # steps_count mirrors the player's last seq, so the next seq needs no lookup; the unique
+    # (match_id, player_id, seq) index rejects a stale counter (e.g. a second tab) instead of duplicating.
+    match_pk, player_pk = match.id, player.id
+    next_seq = (player.steps_count or 0) + 1
+    try:
+        session.add(
+            MatchStep(
+                match_id=match_pk,
+                player_id=player_pk,
+                action=payload.action,
+                x=payload.x,
+                y=payload.y,
+                elapsed_ms=payload.elapsed_ms,
+                seq=next_seq,
+            )
+        )
+        player.steps_count = next_seq
+        _touch_match(match, now)
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        # Counter was stale: compute MAX(seq)+1 inside the INSERT itself and resync steps_count from it.
+        seq_stmt = (
+            insert(MatchStep)
+            .from_select(
+                ["match_id", "player_id", "action", "x", "y", "elapsed_ms", "seq"],
+                select(
+                    literal(match_pk),
+                    literal(player_pk),
+                    literal(payload.action),
+                    literal(payload.x),
+                    literal(payload.y),
+                    literal(payload.elapsed_ms, Integer),
+                    func.coalesce(
+                        select(func.max(MatchStep.seq) + 1)
+                        .where(MatchStep.match_id == match_pk, MatchStep.player_id == player_pk)
+                        .scalar_subquery(),
+                        1,
+                    ),
+                ),
+            )
+            .returning(MatchStep.seq)
+        )
+        seq = (await session.exec(seq_stmt)).scalar_one()
+        await session.exec(
+            update(MatchPlayer).where(MatchPlayer.id == player_pk).values(steps_count=seq).execution_options(synchronize_session=False)
+        )
+        await session.exec(
+            update(Match).where(Match.id == match_pk).values(last_active_at=now).execution_options(synchronize_session=False)
+        )
+        await session.commit()
     return {"ok": True}
 
 
 @router.post("/{match_id}/finish")
-async def finish_match(match_id: int, payload: MatchFinish, session: Session = Depends(get_session)):
-    match = _get_match(session, match_id)
-    player = _get_player_by_token(session, payload.player_token)
-    if not player or player.match_id != match.id:
-        raise HTTPException(status_code=403, detail="invalid player token")
+async def finish_match(match_id: int, payload: MatchFinish, session: AsyncSession = Depends(get_session)):
+    now = datetime.utcnow()
+    match, players, player = await _load_match_context(session, match_id, payload.player_token)
 
-    players = _apply_timeout(session, match)
+    # A timeout only changes state when it finishes the match; that is committed together with any progress below.
+    timed_out = _timeout_match(match, players, now)
     # If already finished, just persist missing progress and return.
     if match.status == MatchStatus.finished:
         if payload.progress is not None and player.progress is None:
-            player.progress = json.dumps(payload.progress)
-            _touch_match(match)
-            session.commit()
+            player.progress = orjson.dumps(payload.progress).decode()
+            _touch_match(match, now)
+            # Revealed-cell counts feed the standings, so a late snapshot can reorder them.
+            _settle_ranks(match, players)
+            timed_out = True
+        if timed_out:
+            await session.commit()
         return {"ok": True}
 
-    now = datetime.utcnow()
-
     completed_board = False
     if payload.progress is not None:
-        try:
-            progress_obj = payload.progress
-            board_snapshot = progress_obj.get("board") if isinstance(progress_obj, dict) else None
-            completed_board = isinstance(board_snapshot, dict) and board_snapshot.get("status") == "won"
-        except Exception:
-            completed_board = False
+        board_snapshot = payload.progress.get("board")
+        completed_board = isinstance(board_snapshot, dict) and board_snapshot.get("status") == "won"
 
     actual_outcome = payload.outcome
     if payload.outcome == "win" and not completed_board:
         actual_outcome = "forfeit"
 
     if payload.progress is not None:
-        player.progress = json.dumps(payload.progress)
+        player.progress = orjson.dumps(payload.progress).decode()
 
     # If player already had a result, do not overwrite outcomes—only persist progress.
     if not player.result:
@@ -505,115 +648,116 @@ async def finish_match(match_id: int, payload: MatchFinish, session: Session = D
         should_finish = all(p.result for p in players)
 
     if should_finish:
-        ranked = _compute_standings(match, players)
-        for rank, p in ranked:
-            p._rank = rank
-            if rank == 1:
-                p.result = "win"
-            else:
-                p.result = "lose"
-            p.finished_at = p.finished_at or now
+        winner_id = _compute_standings(match, players)[0][1].id
+        # Rank 1 wins, the rest lose; the final ranks are taken from that settled state.
+        final = {p.id: "win" if p.id == winner_id else "lose" for p in players}
+        ranks = {p.id: r for r, p in _compute_standings(match, players, final)}
+        total = len(players)
+        # One UPDATE settles every seat (result, finished_at, rank, points). The response doesn't read the rows back.
+        await session.exec(
+            update(MatchPlayer)
+            .where(MatchPlayer.match_id == match.id)
+            .values(
+                result=case((MatchPlayer.id == winner_id, "win"), else_="lose"),
+                finished_at=func.coalesce(MatchPlayer.finished_at, now),
+                rank=case(ranks, value=MatchPlayer.id),
+                points=case({pid: _points_for(r, total) for pid, r in ranks.items()}, value=MatchPlayer.id),
+            )
+            .execution_options(synchronize_session=False)
+        )
         match.status = MatchStatus.finished
         match.ended_at = now
-        _touch_match(match)
-        session.commit()
+        _touch_match(match, now)
+        await session.commit()
         return {"ok": True}
 
-    _touch_match(match)
-    session.commit()
+    _touch_match(match, now)
+    await session.commit()
     return {"ok": True}
 
 
 @router.delete("/{match_id}")
-async def delete_match(match_id: int, payload: MatchDelete, session: Session = Depends(get_session)):
-    match = _get_match(session, match_id)
-    player = _get_player_by_token(session, payload.player_token)
-    if not player or player.match_id != match.id:
-        raise HTTPException(status_code=403, detail="invalid player token")
+async def delete_match(match_id: int, payload: MatchDelete, session: AsyncSession = Depends(get_session)):
+    now = datetime.utcnow()
+    match, players, player = await _load_match_context(session, match_id, payload.player_token)
 
-    players = _list_players(session, match)
     if len(players) > 1:
         raise HTTPException(status_code=400, detail="cannot delete match with multiple players")
 
-    now = datetime.utcnow()
     if match.started_at and now >= match.started_at:
         raise HTTPException(status_code=400, detail="cannot delete a started match")
 
-    # delete steps, players, then match
-    steps_stmt = select(MatchStep).where(MatchStep.match_id == match.id)
-    for step in session.exec(steps_stmt):
-        session.delete(step)
-
-    players_stmt = select(MatchPlayer).where(MatchPlayer.match_id == match.id)
-    for p in session.exec(players_stmt):
-        session.delete(p)
-
-    session.delete(match)
-    session.commit()
+    # delete steps, players, then match: one DELETE each, rows are never loaded
+    await session.exec(delete(MatchStep).where(MatchStep.match_id == match.id))
+    await session.exec(delete(MatchPlayer).where(MatchPlayer.match_id == match.id))
+    await session.delete(match)
+    await session.commit()
     return {"ok": True, "deleted": True}
 
 
 @router.post("/{match_id}/leave")
-async def leave_match(match_id: int, payload: MatchDelete, session: Session = Depends(get_session)):
-    match = _get_match(session, match_id)
-    player = _get_player_by_token(session, payload.player_token)
-    if not player or player.match_id != match.id:
-        raise HTTPException(status_code=403, detail="invalid player token")
-
+async def leave_match(match_id: int, payload: MatchDelete, session: AsyncSession = Depends(get_session)):
     now = datetime.utcnow()
+    match, players, player = await _load_match_context(session, match_id, payload.player_token)
+
     if match.status == MatchStatus.finished or (match.started_at and now >= match.started_at):
         raise HTTPException(status_code=400, detail="cannot leave a started or finished match")
 
-    _remove_player(session, match, player)
+    # Player removal and the match update below share one commit.
+    await _remove_player(session, match, player)
 
-    remaining = _list_players(session, match)
+    remaining = [p for p in players if p.id != player.id]
     if not remaining:
-        session.delete(match)
-        session.commit()
+        await session.delete(match)
+        await session.commit()
         return {"ok": True, "deleted": True}
 
     match.status = MatchStatus.pending
     match.started_at = None
     match.ended_at = None
-    _touch_match(match)
-    session.commit()
-    session.refresh(match)
+    _touch_match(match, now)
+    await session.commit()
     return {"ok": True, "left": True, "players": [p.id for p in remaining], "host_id": _select_host(remaining)}
 
 
 @router.get("/{match_id}/steps", response_model=list[MatchStepRead])
-async def list_steps(match_id: int, session: Session = Depends(get_session)):
-    match = _get_match(session, match_id)
-    stmt = (
-        select(MatchStep, MatchPlayer.name)
+async def list_steps(match_id: int, session: AsyncSession = Depends(get_session)):
+    match = await _get_match(session, match_id)
+    stmt = lambda_stmt(
+        lambda: select(
+            MatchPlayer.name,
+            MatchStep.action,
+            MatchStep.x,
+            MatchStep.y,
+            MatchStep.elapsed_ms,
+            MatchStep.created_at,
+            MatchStep.seq,
+        )
         .join(MatchPlayer, MatchStep.player_id == MatchPlayer.id)
-        .where(MatchStep.match_id == match.id)
+        .where(MatchStep.match_id == match_id)
         .order_by(MatchStep.created_at.asc(), MatchStep.id.asc())
     )
-    rows = session.exec(stmt).all()
-    return [
-        MatchStepRead(
-            player_name=name,
-            action=step.action,
-            x=step.x,
-            y=step.y,
-            elapsed_ms=step.elapsed_ms,
-            created_at=step.created_at,
-            seq=step.seq,
-        )
-        for step, name in rows
-    ]
+    rows = (await session.exec(stmt)).all()
+    # Only the response columns are fetched (no MatchStep entities); plain dicts go straight to orjson,
+    # so a match with thousands of steps skips per-row MatchStepRead validation.
+    return ORJSONResponse(
+        [
+            {"player_name": n, "action": a, "x": x, "y": y, "elapsed_ms": e, "created_at": c, "seq": s}
+            for n, a, x, y, e, c, s in rows
+        ]
+    )
 
 
 @router.get("/history", response_model=list[MatchHistoryItem])
-async def match_history(player: str, session: Session = Depends(get_session)):
+async def match_history(player: str, session: AsyncSession = Depends(get_session)):
     stmt = select(MatchPlayer, Match).join(Match, MatchPlayer.match_id == Match.id).where(MatchPlayer.name == player)
-    rows = session.exec(stmt).all()
+    rows = (await session.exec(stmt)).all()
+    matches = list({match.id: match for _, match in rows}.values())
+    await _apply_timeouts(session, matches, datetime.utcnow())
     history: list[MatchHistoryItem] = []
     for mp, match in rows:
-        _apply_timeout(session, match)
         history.append(
-            MatchHistoryItem(
+            MatchHistoryItem.model_construct(
                 match_id=match.id,
                 status=match.status.value,
                 created_at=match.created_at,
@@ -626,28 +770,23 @@ async def match_history(player: str, session: Session = Depends(get_session)):
                 duration_ms=mp.duration_ms,
             )
         )
-    return history
+    return Response(content=_HISTORY_JSON.dump_json(history), media_type="application/json")
 
 
 @router.get("/recent", response_model=list[RecentMatch])
-async def recent_matches(session: Session = Depends(get_session)):
-    stmt_matches = select(Match).order_by(Match.created_at.desc()).limit(10)
-    matches = session.exec(stmt_matches).all()
+async def recent_matches(session: AsyncSession = Depends(get_session)):
+    stmt_matches = select(Match).order_by(Match.created_at.desc(), Match.id.desc()).limit(10)
+    matches = (await session.exec(stmt_matches)).all()
 
-    match_ids = [m.id for m in matches if m.id is not None]
-    players_by_match: dict[int, list[MatchPlayer]] = {mid: [] for mid in match_ids}
-    if match_ids:
-        stmt_players = select(MatchPlayer).where(MatchPlayer.match_id.in_(match_ids))
-        for player in session.exec(stmt_players).all():
-            players_by_match.setdefault(player.match_id, []).append(player)
+    players_by_match = await _players_by_match(session, [m.id for m in matches if m.id is not None])
+    await _apply_timeouts(session, matches, datetime.utcnow(), players_by_match)
 
     recent: list[RecentMatch] = []
     for match in matches:
-        _apply_timeout(session, match)
         players = players_by_match.get(match.id, []) if match.id is not None else []
         host_id = _select_host(players)
         recent.append(
-            RecentMatch(
+            RecentMatch.model_construct(
                 match_id=match.id,
                 status=match.status.value,
                 created_at=match.created_at,
@@ -658,9 +797,10 @@ async def recent_matches(session: Session = Depends(get_session)):
                 mines=match.mines,
                 host_id=host_id,
                 players=[
-                    RecentMatchPlayer(id=p.id, name=p.name, result=p.result, ready=p.ready, is_host=p.id == host_id) for p in players
+                    RecentMatchPlayer.model_construct(id=p.id, name=p.name, result=p.result, ready=p.ready, is_host=p.id == host_id)
+                    for p in players
                 ],
             )
         )
 
-    return recent
+    return Response(content=_RECENT_JSON.dump_json(recent), media_type="application/json")
@@ -1,172 +1,165 @@
-from fastapi import APIRouter, Depends
-from sqlmodel import Session, select, func
+from typing import Any
 
+from fastapi import APIRouter, Depends, Response
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import bindparam
+from sqlalchemy.orm import aliased
+from sqlmodel import select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ..cache import TTLCache
 from ..db import get_session
 from ..models import LeaderboardEntry, LeaderboardReplay, Match, MatchPlayer, MatchStatus, User
 from ..schemas import ProfileResponse, ProfileBestScore, MatchHistoryItem
-from ..schemas import RankBoard, RankEntry
-from .match import _compute_standings
+from ..schemas import RankBoard
 from .auth import get_current_user, get_current_user_optional
 
 router = APIRouter(prefix="/api/profile", tags=["profile"])
 
+# 排行榜前幾名人人看到的都一樣；容許 30 秒延遲，短時間內直接共用
+_RANK_SCORES_CACHE = TTLCache(maxsize=1, ttl=30)
+
 
-def _best_scores(session: Session, handle: str) -> list[ProfileBestScore]:
-    stmt = (
-        select(LeaderboardEntry.difficulty, func.min(LeaderboardEntry.time_ms).label("best_time"))
-        .where(LeaderboardEntry.player == handle)
-        .group_by(LeaderboardEntry.difficulty)
+def _best_scores_query():
+    # (difficulty, player) is unique, so each row already is the player's best for that difficulty:
+    # one query with the replay flag as EXISTS instead of 1 + 2 queries per difficulty.
+    has_replay = select(LeaderboardReplay.id).where(LeaderboardReplay.entry_id == LeaderboardEntry.id).exists()
+    return (
+        select(LeaderboardEntry.id, LeaderboardEntry.difficulty, LeaderboardEntry.time_ms, LeaderboardEntry.created_at, has_replay)
+        .where(LeaderboardEntry.player == bindparam("handle"))
+        .order_by(LeaderboardEntry.difficulty)
     )
-    rows = session.exec(stmt).all()
-    best: list[ProfileBestScore] = []
-    for diff, best_time in rows:
-        # fetch the earliest entry with that best time for timestamp
-        first = (
-            session.exec(
-                select(LeaderboardEntry)
-                .where(LeaderboardEntry.player == handle, LeaderboardEntry.difficulty == diff, LeaderboardEntry.time_ms == best_time)
-                .order_by(LeaderboardEntry.created_at.asc())
-            ).first()
+
+
+async def _best_scores(session: AsyncSession, handle: str) -> list[ProfileBestScore]:
+    rows = (await session.exec(_BEST_SCORES, params={"handle": handle})).all()
+    return [
+        ProfileBestScore.model_construct(
+            difficulty=diff, time_ms=time_ms, created_at=created_at, entry_id=entry_id, has_replay=bool(replay)
+        )
+        for entry_id, diff, time_ms, created_at, replay in rows
+    ]
+
+
+def _match_history_query():
+    # Only the columns the history item shows: plain rows, no ORM identity-map bookkeeping per seat/match.
+    # Match ids are assigned in creation order, so newest-first walks (user_id, match_id) backwards and
+    # stops after `limit` seats instead of sorting all of the user's matches by created_at.
+    return (
+        select(
+            Match.id,
+            Match.status,
+            Match.created_at,
+            Match.ended_at,
+            Match.difficulty,
+            Match.width,
+            Match.height,
+            Match.mines,
+            MatchPlayer.result,
+            MatchPlayer.duration_ms,
         )
-        if first:
-            has_replay = session.exec(select(LeaderboardReplay).where(LeaderboardReplay.entry_id == first.id)).first() is not None
-            best.append(
-                ProfileBestScore(
-                    difficulty=diff,
-                    time_ms=best_time,
-                    created_at=first.created_at,
-                    entry_id=first.id,
-                    has_replay=has_replay,
-                )
-            )
-    return best
-
-
-def _match_history(session: Session, user_id: int, limit: int = 30) -> list[MatchHistoryItem]:
-    stmt = (
-        select(MatchPlayer, Match)
         .join(Match, MatchPlayer.match_id == Match.id)
-        .where(MatchPlayer.user_id == user_id)
-        .order_by(Match.created_at.desc())
-        .limit(limit)
+        .where(MatchPlayer.user_id == bindparam("user_id"))
+        .order_by(MatchPlayer.match_id.desc())
+        .limit(bindparam("limit"))
     )
-    rows = session.exec(stmt).all()
-    history: list[MatchHistoryItem] = []
-    for mp, match in rows:
-        history.append(
-            MatchHistoryItem(
-                match_id=match.id,
-                status=match.status.value,
-                created_at=match.created_at,
-                ended_at=match.ended_at,
-                difficulty=match.difficulty,
-                width=match.width,
-                height=match.height,
-                mines=match.mines,
-                result=mp.result,
-                duration_ms=mp.duration_ms,
-            )
+
+
+async def _match_history(session: AsyncSession, user_id: int, limit: int = 30) -> list[MatchHistoryItem]:
+    rows = (await session.exec(_MATCH_HISTORY, params={"user_id": user_id, "limit": limit})).all()
+    return [
+        MatchHistoryItem.model_construct(
+            match_id=match_id,
+            status=status.value,
+            created_at=created_at,
+            ended_at=ended_at,
+            difficulty=difficulty,
+            width=width,
+            height=height,
+            mines=mines,
+            result=result,
+            duration_ms=duration_ms,
+        )
+        for match_id, status, created_at, ended_at, difficulty, width, height, mines, result, duration_ms in rows
+    ]
+
+
+def _players_in_match():
+    """Correlated COUNT of the players in MatchPlayer's match (the `total` the rank rules use)."""
+    seats = aliased(MatchPlayer)
+    return select(func.count()).where(seats.match_id == MatchPlayer.match_id).scalar_subquery()
+
+
+def _rank_counts_query():
+    # Ranks are stored when a match finishes, so this is one aggregate over the user's finished seats.
+    total = _players_in_match()
+    return (
+        select(
+            func.count().filter(MatchPlayer.rank == 1),
+            func.count().filter(MatchPlayer.rank == 2),
+            func.count().filter(MatchPlayer.rank == 3),
+            func.count().filter(MatchPlayer.rank == total),
         )
-    return history
-
-
-def _rank_counts(session: Session, user_id: int) -> dict:
-    counts = {"first": 0, "second": 0, "third": 0, "last": 0}
-    matches = session.exec(
-        select(Match)
-        .join(MatchPlayer, MatchPlayer.match_id == Match.id)
-        .where(MatchPlayer.user_id == user_id, Match.status == MatchStatus.finished)
-    ).all()
-
-    for match in matches:
-        players = session.exec(select(MatchPlayer).where(MatchPlayer.match_id == match.id)).all()
-        if not players:
-            continue
-        standings = _compute_standings(match, players)
-        total = len(players)
-        rank_map = {p.id: r for r, p in standings}
-        user_player = next((p for p in players if p.user_id == user_id), None)
-        if not user_player:
-            continue
-        rank = rank_map.get(user_player.id)
-        if rank is None:
-            continue
-        if rank == 1:
-            counts["first"] += 1
-        if rank == 2:
-            counts["second"] += 1
-        if rank == 3:
-            counts["third"] += 1
-        if rank == total:
-            counts["last"] += 1
-
-    return counts
-
-
-def _first_place_board(session: Session, current_user_id: int | None, limit: int = 20) -> RankBoard:
-    def _points_for(rank: int, total: int) -> int:
-        if total < 2:
-            return 0
-        if total == 2:
-            base = [10, 2]
-            return base[rank - 1] if rank <= 2 else 1
-        if total == 3:
-            base = [14, 7, 2]
-            return base[rank - 1] if rank <= 3 else 1
-        if total == 4:
-            base = [18, 10, 5, 2]
-            return base[rank - 1] if rank <= 4 else 1
-        value = round(25 * (1 - (rank - 1) / total) ** 1.1) + 1
-        return max(value, 1)
-
-    scores: dict[str, int] = {}
-
-    # 1. 先把所有已註冊玩家加入，預設 0 分
-    all_users = session.exec(select(User)).all()
-    for u in all_users:
-        scores[u.handle] = 0
-
-    # 2. 計算比賽分數
-    matches = session.exec(select(Match).where(Match.status == MatchStatus.finished)).all()
-    for match in matches:
-        players = session.exec(select(MatchPlayer).where(MatchPlayer.match_id == match.id)).all()
-        if not players:
-            continue
-        standings = _compute_standings(match, players)
-        total = len(standings)
-        if total == 0:
-            continue
-        for rank, p in standings:
-            # 以 handle 累加分數
-            if p.user_id is not None:
-                user = session.get(User, p.user_id)
-                if user:
-                    scores[user.handle] += _points_for(rank, total)
-
-    # 3. 排序並取前 limit
-    top_sorted = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
-    top_entries = [RankEntry(handle=h, score=c) for h, c in top_sorted[:limit]]
-
-    # 4. me_entry
+        .join(Match, MatchPlayer.match_id == Match.id)
+        .where(MatchPlayer.user_id == bindparam("user_id"), Match.status == MatchStatus.finished)
+    )
+
+
+async def _rank_counts(session: AsyncSession, user_id: int) -> dict:
+    first, second, third, last = (await session.exec(_RANK_COUNTS, params={"user_id": user_id})).one()
+    return {"first": first, "second": second, "third": third, "last": last}
+
+
+# Built once at import; each call only binds its parameters, and the compiled SQL is reused from the cache.
+_BEST_SCORES = _best_scores_query()
+_MATCH_HISTORY = _match_history_query()
+_RANK_COUNTS = _rank_counts_query()
+# 分數在對戰結束時已存入 (未結束的座位為 0)，直接在資料庫加總；沒有對戰紀錄的玩家以 0 分列入
+_SCORE = func.coalesce(func.sum(MatchPlayer.points), 0).label("score")
+_TOP_SCORES = (
+    select(User.handle, _SCORE)
+    .outerjoin(MatchPlayer, MatchPlayer.user_id == User.id)
+    .group_by(User.id, User.handle)
+    .order_by(_SCORE.desc(), User.handle)
+    .limit(bindparam("limit"))
+)
+_USER_SCORE = select(func.coalesce(func.sum(MatchPlayer.points), 0)).where(MatchPlayer.user_id == bindparam("user_id"))
+
+
+async def _first_place_board(session: AsyncSession, current_user: User | None, limit: int = 20) -> dict[str, Any]:
+    """RankBoard as a plain dict: rank_board hands it straight to orjson."""
+    top_entries = _RANK_SCORES_CACHE.get(limit)
+    if top_entries is None:
+        rows = (await session.exec(_TOP_SCORES, params={"limit": limit})).all()
+        top_entries = [{"handle": h, "score": c} for h, c in rows]
+        _RANK_SCORES_CACHE.set(limit, top_entries)
+
+    # me_entry 只加總目前玩家自己的座位 (user_id 有索引)，不必掃過所有玩家
     me_entry = None
-    if current_user_id is not None:
-        user = session.get(User, current_user_id)
-        if user:
-            me_entry = RankEntry(handle=user.handle, score=scores.get(user.handle, 0))
+    if current_user is not None:
+        score = (await session.exec(_USER_SCORE, params={"user_id": current_user.id})).one()
+        me_entry = {"handle": current_user.handle, "score": score}
+
+    return {"top": top_entries, "me": me_entry}
 
-    return RankBoard(top=top_entries, me=me_entry)
 
 @router.get("/me", response_model=ProfileResponse)
-async def profile_me(session: Session = Depends(get_session), user=Depends(get_current_user)):
+async def profile_me(session: AsyncSession = Depends(get_session), user=Depends(get_current_user)):
     if not user:
         return ProfileResponse(handle="", best_scores=[], match_history=[], rank_counts={"first": 0, "second": 0, "third": 0, "last": 0})
 
-    best_scores = _best_scores(session, user.handle)
-    match_history = _match_history(session, user.id)
-    rank_counts = _rank_counts(session, user.id)
-    return ProfileResponse(handle=user.handle, best_scores=best_scores, match_history=match_history, rank_counts=rank_counts)
+    best_scores = await _best_scores(session, user.handle)
+    match_history = await _match_history(session, user.id)
+    rank_counts = await _rank_counts(session, user.id)
+    # Built from DB rows with model_construct (no validation) and serialized here, so FastAPI doesn't dump and
+    # re-validate every history item; response_model still documents the shape.
+    profile = ProfileResponse.model_construct(
+        handle=user.handle, best_scores=best_scores, match_history=match_history, rank_counts=rank_counts
+    )
+    return Response(content=profile.model_dump_json(), media_type="application/json")
 
 
 @router.get("/rankings", response_model=RankBoard)
-async def rank_board(session: Session = Depends(get_session), user=Depends(get_current_user_optional)):
-    return _first_place_board(session, user.id if user else None, limit=20)
+async def rank_board(session: AsyncSession = Depends(get_session), user=Depends(get_current_user_optional)):
+    # response_model stays for the OpenAPI schema; the dict is serialized by orjson without model instances.
+    return ORJSONResponse(await _first_place_board(session, user, limit=20))
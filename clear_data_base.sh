@@ -23,18 +23,23 @@ if [ -z "$PY_BIN" ]; then
 fi
 
 "$PY_BIN" - <<'PY'
-from sqlmodel import Session
+import asyncio
 from sqlalchemy import text
 from app.db import engine
 
 tables = ['matchstep', 'matchplayer', '"match"', 'leaderboardentry']
-with Session(engine) as s:
-    for t in tables:
-        s.exec(text(f"DELETE FROM {t};"))
-    try:
-        s.exec(text("DELETE FROM sqlite_sequence WHERE name in ('matchstep','matchplayer','match','leaderboardentry');"))
-    except Exception as e:
-        print("sqlite_sequence reset skipped:", e)
-    s.commit()
+
+
+async def main():
+    async with engine.begin() as conn:
+        for t in tables:
+            await conn.execute(text(f"DELETE FROM {t};"))
+        try:
+            await conn.execute(text("DELETE FROM sqlite_sequence WHERE name in ('matchstep','matchplayer','match','leaderboardentry');"))
+        except Exception as e:
+            print("sqlite_sequence reset skipped:", e)
+    await engine.dispose()
+
+asyncio.run(main())
 print("cleared leaderboard and match records")
 PY
\ No newline at end of file
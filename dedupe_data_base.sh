@@ -0,0 +1,38 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+cd "$(dirname "$0")/backend"
+
+PY_BIN=""
+if [ -x ../.venv/bin/python ]; then
+    PY_BIN="../.venv/bin/python"
+elif [ -x ../.venv/Scripts/python.exe ]; then
+    PY_BIN="../.venv/Scripts/python.exe"
+elif [ -x ../.venv/Scripts/python ]; then
+    PY_BIN="../.venv/Scripts/python"
+elif command -v python3 >/dev/null 2>&1; then
+    PY_BIN="python3"
+elif command -v python >/dev/null 2>&1; then
+    PY_BIN="python"
+fi
+
+if [ -z "$PY_BIN" ]; then
+    echo "python not found; please install or activate a venv"
+    exit 1
+fi
+
+"$PY_BIN" - <<'PY'
+import asyncio
+from app.db import dedupe_for_unique_indexes, engine
+
+
+async def main():
+    async with engine.begin() as conn:
+        counts = await conn.run_sync(dedupe_for_unique_indexes)
+    await engine.dispose()
+    for label, rows in counts:
+        print(f"{label}: {rows}")
+
+asyncio.run(main())
+print("removed duplicate rows; the unique indexes are created on the next startup")
+PY
@@ -22,16 +22,20 @@ if [ -z "$PY_BIN" ]; then
 fi
 
 "$PY_BIN" - <<'PY'
-from sqlmodel import Session
+import asyncio
 from sqlalchemy import text
 from app.db import engine
 
-with Session(engine) as s:
-    s.exec(text("DELETE FROM user;"))
-    try:
-        s.exec(text("DELETE FROM sqlite_sequence WHERE name = 'user';"))
-    except Exception as e:
-        print("sqlite_sequence reset skipped:", e)
-    s.commit()
+
+async def main():
+    async with engine.begin() as conn:
+        await conn.execute(text("DELETE FROM user;"))
+        try:
+            await conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'user';"))
+        except Exception as e:
+            print("sqlite_sequence reset skipped:", e)
+    await engine.dispose()
+
+asyncio.run(main())
 print("cleared all users (accounts/passwords)")
 PY